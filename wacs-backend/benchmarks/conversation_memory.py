@@ -0,0 +1,148 @@
+"""Memory benchmark for the conversation store.
+
+Builds N synthetic conversations three ways and reports traced memory:
+  1. baseline  - the original layout: one dict per message with a float timestamp
+  2. compact   - ConversationManager with slotted Message records
+  3. compressed - compact records with every idle history packed by HistoryCodec
+
+Usage (from wacs-backend/):
+    python benchmarks/conversation_memory.py [--conversations 100000]
+"""
+import argparse
+import ast
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from conversation_store import ConversationManager, HistoryCodec, MAX_MESSAGES  # noqa: E402
+
+NAMES = ['Ade', 'Chioma', 'Ibrahim', 'Ngozi', 'Tunde', 'Aisha', 'Emeka', 'Funke', 'Musa', 'Bola']
+OPENERS = ['Got it! ', 'I see the issue! ', 'I know this is frustrating, let\'s fix it! ', 'Sure thing! ', '']
+CLOSERS = [' Anything else I can help with?', ' Happy to help 😊', ' Let me know if you need more help!', '']
+USER_TEMPLATES = [
+    'my loan deduction is still ongoing since {month}, I already paid off',
+    'I was short paid by N{amount} this month',
+    'how do I get letter of non indebtedness from {lender}',
+    'please I applied for loan of N{amount} on {day} and have not received it',
+    'what is the interest rate for {lender}',
+    'how can I check my loan balance',
+    'thank you',
+    'I did not take any loan but N{amount} was deducted',
+]
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June']
+LENDERS = ['Alpha MFB', 'Crest Finance', 'Sterling Credit', 'Prime Lenders']
+
+
+def load_faq_answers():
+    """Read wacs_faqs from wacs_chatbot.py without importing it (and loading the model)"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'wacs_chatbot.py')
+    tree = ast.parse(open(path, encoding='utf-8').read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, 'id', None) == 'wacs_faqs' for t in node.targets):
+            return ast.literal_eval(node.value)
+    raise RuntimeError('wacs_faqs not found in wacs_chatbot.py')
+
+
+def synthetic_conversations(count, faqs, seed=7):
+    """Yield (conversation_id, user_name, [(role, content, timestamp), ...])"""
+    rng = random.Random(seed)
+    now = time.time()
+    for i in range(count):
+        started = now - rng.randint(0, 20 * 3600)
+        messages = [('assistant', 'Hello! May I know your name?', started)]
+        name = rng.choice(NAMES)
+        messages.append(('assistant', f'Hello {name}! Nice to meet you 😊 How can I help you today?', started + 5))
+        for turn in range(rng.randint(2, 5)):
+            user = rng.choice(USER_TEMPLATES).format(
+                month=rng.choice(MONTHS), amount=rng.randint(5, 500) * 1000,
+                lender=rng.choice(LENDERS), day=rng.choice(['Monday', 'yesterday', 'last week'])
+            )
+            # Bot replies are Claude's rewording of FAQ answers, so reuse answer sentences
+            sentences = rng.choice(faqs)['answer'].replace('\n', ' ').split('. ')
+            reply = rng.choice(OPENERS) + '. '.join(sentences[:rng.randint(1, 2)]).strip() + rng.choice(CLOSERS)
+            messages.append(('user', user, started + 60 * turn + 20))
+            messages.append(('assistant', reply, started + 60 * turn + 25))
+        yield f'conv-{i:07d}', name, messages[-MAX_MESSAGES:]
+
+
+def build_baseline(conversations):
+    store = {}
+    for conv_id, name, messages in conversations:
+        store[conv_id] = {
+            'user_name': name,
+            'created_at': messages[0][2],
+            'last_activity': messages[-1][2],
+            'messages': [{'role': role, 'content': content, 'timestamp': ts} for role, content, ts in messages]
+        }
+    return store
+
+
+def build_manager(conversations, codec):
+    manager = ConversationManager(compress_after=0, codec=codec)
+    for conv_id, name, messages in conversations:
+        conv = manager.get_or_create_conversation(conv_id)
+        conv['user_name'] = name
+        for role, content, _ in messages:
+            manager.add_message(conv_id, role, content)
+        conv['last_activity'] = messages[-1][2]
+    return manager
+
+
+def measure(label, build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f'{label:<12} {(after - before) / 2 ** 20:>10.1f} MiB   built in {elapsed:6.1f}s')
+    return result, after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--conversations', type=int, default=100000)
+    args = parser.parse_args()
+
+    faqs = load_faq_answers()
+    # Each build regenerates the same data so message strings are counted against the store holding them
+    def conversations():
+        return synthetic_conversations(args.conversations, faqs)
+
+    total_messages = sum(len(m) for _, _, m in conversations())
+    codec = HistoryCodec([f['question'] for f in faqs] + [f['answer'] for f in faqs])
+    print(f'{args.conversations} conversations, {total_messages} messages, codec={codec.backend}\n')
+
+    baseline, baseline_bytes = measure('baseline', lambda: build_baseline(conversations()))
+    del baseline
+    compact, compact_bytes = measure('compact', lambda: build_manager(conversations(), codec))
+    del compact
+
+    def compressed_build():
+        manager = build_manager(conversations(), codec)
+        manager.compress_idle_conversations()
+        return manager
+
+    manager, compressed_bytes = measure('compressed', compressed_build)
+
+    # Cost of the lazy path: inflate a sample of idle histories on read
+    sample = random.Random(1).sample(list(manager.conversations), min(10000, len(manager.conversations)))
+    started = time.perf_counter()
+    for conv_id in sample:
+        manager.get_conversation_history(conv_id)
+    per_read = (time.perf_counter() - started) / len(sample) * 1e6
+
+    print(f'\ncompact saves    {100 * (1 - compact_bytes / baseline_bytes):5.1f}% vs baseline')
+    print(f'compressed saves {100 * (1 - compressed_bytes / baseline_bytes):5.1f}% vs baseline')
+    print(f'first read of a compressed history: {per_read:.1f} µs')
+
+
+if __name__ == '__main__':
+    main()
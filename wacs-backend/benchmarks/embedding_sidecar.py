@@ -0,0 +1,103 @@
+"""Compare RSS and throughput of N workers embedding in-process vs through the shared sidecar.
+
+Each worker process embeds single queries in a loop, the way /chat does. In
+"local" mode every worker loads MiniLM itself; in "sidecar" mode one
+embedding_service.py process loads it and workers talk to it over a Unix socket.
+
+Needs the full backend requirements (sentence-transformers). Linux only (reads /proc).
+
+Usage (from wacs-backend/):
+    python benchmarks/embedding_sidecar.py --workers 1 2 4 8 --queries 500 [--model PATH]
+"""
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BACKEND_DIR)
+
+QUERIES = [
+    'my salary is short', 'how do I stop my loan deduction', 'where can I get my payslip',
+    'what is WACS', 'I have not received my loan', 'how can I check my loan balance',
+    'COOP deduction on my payslip', 'letter of non indebtedness',
+]
+
+
+def rss_mb(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def worker(mode, model, socket_path, queries, ready, start, results):
+    from embedding_service import EmbeddingClient
+    client = EmbeddingClient(model, socket_path=socket_path if mode == 'sidecar' else None)
+    if mode == 'sidecar':
+        client.wait_for_sidecar(60)
+    client.encode(['warm up'], normalize_embeddings=True)
+    ready.put(os.getpid())
+    start.wait()
+    started = time.perf_counter()
+    for i in range(queries):
+        client.encode([QUERIES[i % len(QUERIES)]], normalize_embeddings=True)
+    results.put((os.getpid(), time.perf_counter() - started, rss_mb(os.getpid()), client.get_stats()))
+
+
+def run(mode, model, workers, queries):
+    ctx = multiprocessing.get_context('spawn')
+    ready, results, start = ctx.Queue(), ctx.Queue(), ctx.Event()
+    socket_path = os.path.join(tempfile.mkdtemp(), 'embed.sock')
+    sidecar = None
+    if mode == 'sidecar':
+        sidecar = subprocess.Popen(
+            [sys.executable, os.path.join(BACKEND_DIR, 'embedding_service.py'), '--socket', socket_path,
+             '--model', model]
+        )
+
+    procs = [ctx.Process(target=worker, args=(mode, model, socket_path, queries, ready, start, results))
+             for _ in range(workers)]
+    for p in procs:
+        p.start()
+    for _ in procs:
+        ready.get()
+    start.set()
+    wall_started = time.perf_counter()
+    outcomes = [results.get() for _ in procs]
+    wall = time.perf_counter() - wall_started
+
+    worker_rss = sum(o[2] for o in outcomes)
+    sidecar_rss = rss_mb(sidecar.pid) if sidecar else 0.0
+    for p in procs:
+        p.join()
+    if sidecar:
+        sidecar.terminate()
+        sidecar.wait()
+
+    total = workers * queries
+    print(f'{mode:<8} workers={workers}  RSS workers={worker_rss:7.0f} MB  sidecar={sidecar_rss:6.0f} MB  '
+          f'total={worker_rss + sidecar_rss:7.0f} MB  throughput={total / wall:7.1f} q/s')
+    if mode == 'sidecar' and any(o[3]['local_calls'] for o in outcomes):
+        print('  warning: some workers fell back to in-process embedding')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--queries', type=int, default=500, help='queries per worker')
+    parser.add_argument('--model', default=os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2'),
+                        help='model name or local path, as for EMBEDDING_MODEL')
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        run('local', args.model, workers, args.queries)
+        run('sidecar', args.model, workers, args.queries)
+
+
+if __name__ == '__main__':
+    main()
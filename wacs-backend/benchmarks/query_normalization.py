@@ -0,0 +1,174 @@
+"""Measure what query normalization does to retrieval accuracy and retrieval-cache hit rate.
+
+Cache hit rate and the count of correctly spelled words the corrector rewrites
+only need the standard library. Retrieval accuracy embeds the
+queries with the production index, so it needs the full backend requirements
+and is skipped when sentence-transformers is not installed.
+
+TEST_SET is the development set the synonym tables were written against, so
+its accuracy overstates the gain; HELD_OUT_SET (retrieval_queries.py) is not.
+
+Usage (from wacs-backend/):
+    python benchmarks/query_normalization.py [--stream 20000]
+"""
+import argparse
+import ast
+import os
+import random
+import sys
+from collections import OrderedDict
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..'))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from query_normalizer import QueryNormalizer  # noqa: E402
+from retrieval_queries import HELD_OUT_SET  # noqa: E402
+
+# (user message, start of the FAQ question it should retrieve)
+TEST_SET = [
+    ("wacs deducton", "How can I effect stoppage"),
+    ("how do i stop my WACS deduction", "How can I effect stoppage"),
+    ("COOP/CTLS deduction wetin be the difference", "How can I differentiate"),
+    ("diff btw wacs remita and coop deductions", "How can I differentiate"),
+    ("wat is wacs", "What is WACS?"),
+    ("WHAT DOES WACS MEAN", "What is WACS?"),
+    ("how i go get non indebtedness leter", "How can I get a Letter of Non-Indebtedness?"),
+    ("abeg where i fit see my pay slip", "Where can I get my payslip?"),
+    ("my salo is short", "I was short-paid"),
+    ("I was SHORT PAID this month!!", "I was short-paid"),
+    ("i was shortpaid", "I was short-paid"),
+    ("my net pay is diferent from wetin i receive", "My net pay is different"),
+    ("does ippis give loan", "Does IPPIS give out loans?"),
+    ("I.P.P.I.S dey give loan?", "Does IPPIS give out loans?"),
+    ("how i go collect refnd", "How can I get my refund?"),
+    ("my loan statment", "How can I get my loan statement?"),
+    ("dem credit me loan wey i no apply for", "I did not request for a loan, but I was credited"),
+    ("i don finish pay my loan but dem still dey deduct", "I have liquidated my loan"),
+    ("loan finished but deductons still ongoing", "I have liquidated my loan"),
+    ("applied on oagf app yesterday no money yet", "I applied for a loan through the IPPIS-OAGF Mobile"),
+    ("lender never disburse my loan", "I applied for a loan through a registered lender"),
+    ("how i fit check my loan balanse", "How can I check my loan balance?"),
+    ("my loan bal", "How can I check my loan balance?"),
+    ("who fit apply for loan", "Who can apply for a loan"),
+    ("how much i fit borrow", "How much can I borrow"),
+    ("wetin be the intrest rate", "What is the interest rate"),
+    ("can i change my repayment schedual", "Can I change the repayment schedule"),
+    ("i no be government worker can i take loan", "Can I apply for a loan through the IPPIS-OAGF Application if I am not"),
+    ("how i go pay back my loan", "How do I repay my loan?"),
+    ("when repayment go start", "When do I start repaying my loan?"),
+    ("which acct dem go pay the loan", "Which account will my loan be paid into?"),
+    ("ippis suport phone number", "How can I contact IPPIS Support?"),
+    ("dem deduct me for loan i no collect", "I didn't request a loan but was erroneously deducted?"),
+    ("lenders contact info", "How can I get Lenders Contact Information?"),
+    ("how i go request loan", "How can I request for a loan?"),
+    ("i wan change my phone numba", "How can I update my phone number?"),
+    ("i never receive salary this month", "I have not received my salary for this Month?"),
+    ("i just marry i wan change my surname", "I would like to update my maiden name"),
+    ("change my bank acct on payslip", "How can I change my Account details on my Payslip?"),
+    ("my D.O.B is wrong", "How can I change my date of birth?"),
+    ("my loan deducton increase", "I experienced an increase in my loan deduction?"),
+]
+
+
+def load_faqs():
+    """Read wacs_faqs from wacs_chatbot.py without importing it (and loading the model)"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'wacs_chatbot.py')
+    tree = ast.parse(open(path, encoding='utf-8').read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, 'id', None) == 'wacs_faqs' for t in node.targets):
+            return ast.literal_eval(node.value)
+    raise RuntimeError('wacs_faqs not found in wacs_chatbot.py')
+
+
+# Correctly spelled words users send that are not in the FAQ vocabulary; none should be rewritten
+REAL_WORDS = [
+    "rejected", "excess", "doctor", "office", "nurse", "teacher", "police", "pension", "arrears",
+    "promotion", "transfer", "retired", "allowance", "overtime", "hospital", "school", "ministry",
+    "agency", "sister", "brother", "husband", "wife", "died", "urgent", "fraud", "scam",
+    "wait", "reduced", "minister", "waiting", "posted", "staff", "bonus", "arrest",
+]
+
+
+def surface_variant(text, rng):
+    """How the same question tends to arrive: different casing, punctuation and small typos"""
+    if rng.random() < 0.3:
+        text = text.upper()
+    elif rng.random() < 0.5:
+        text = text.capitalize()
+    if rng.random() < 0.5:
+        text += rng.choice(['?', '??', '!!', ' pls', ' please'])
+    if rng.random() < 0.5:
+        words = text.split()
+        i = rng.randrange(len(words))
+        if len(words[i]) > 5:
+            j = rng.randrange(1, len(words[i]) - 1)
+            words[i] = words[i][:j] + words[i][j + 1:]
+        text = ' '.join(words)
+    return text
+
+
+def cache_hit_rate(keys, size):
+    cache, hits = OrderedDict(), 0
+    for key in keys:
+        if key in cache:
+            cache.move_to_end(key)
+            hits += 1
+        else:
+            cache[key] = True
+            if len(cache) > size:
+                cache.popitem(last=False)
+    return hits / len(keys)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stream', type=int, default=20000, help='number of simulated queries')
+    parser.add_argument('--cache-size', type=int, default=2048)
+    args = parser.parse_args()
+
+    normalizer = QueryNormalizer(load_faqs())
+
+    rng = random.Random(3)
+    stream = [surface_variant(rng.choice(TEST_SET)[0], rng) for _ in range(args.stream)]
+    raw_rate = cache_hit_rate([q.strip().lower() for q in stream], args.cache_size)
+    canonical_rate = cache_hit_rate([normalizer.normalize(q) for q in stream], args.cache_size)
+    # Production key: both scored texts, so a hit always returns what scoring would have
+    production_rate = cache_hit_rate([(normalizer.surface(q), normalizer.normalize(q)) for q in stream],
+                                     args.cache_size)
+    print(f'Cache hit rate over {args.stream} queries (LRU {args.cache_size}):')
+    print(f'  lowercased raw key  {raw_rate:6.1%}')
+    print(f'  canonical key       {canonical_rate:6.1%}')
+    print(f'  surface + canonical {production_rate:6.1%}\n')
+
+    rewritten = [(w, normalizer.normalize(w)) for w in REAL_WORDS if normalizer.normalize(w) != w]
+    print(f'Correctly spelled words rewritten: {len(rewritten)}/{len(REAL_WORDS)}')
+    for word, canonical in rewritten:
+        print(f'  {word} -> {canonical}')
+    print()
+
+    try:
+        import sentence_transformers  # noqa: F401
+    except ImportError:
+        print('Retrieval accuracy: skipped (sentence-transformers not installed)')
+        return
+
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'unused-by-benchmark')
+    from wacs_chatbot import rag_system, wacs_faqs
+
+    for name, queries in [('development TEST_SET', TEST_SET), ('held-out set', HELD_OUT_SET)]:
+        raw_correct = canonical_correct = combined_correct = 0
+        for query, expected in queries:
+            target = next(i for i, faq in enumerate(wacs_faqs) if faq['question'].startswith(expected))
+            raw, canonical = normalizer.surface(query), normalizer.normalize(query)
+            raw_correct += int(rag_system.score_faqs(raw).argmax() == target)
+            canonical_correct += int(rag_system.score_faqs(canonical).argmax() == target)
+            combined_correct += int(rag_system.score_faqs(raw, canonical).argmax() == target)
+        print(f'Top-1 retrieval accuracy, {name} ({len(queries)} queries):')
+        print(f'  surface query           {raw_correct / len(queries):6.1%}')
+        print(f'  canonical query         {canonical_correct / len(queries):6.1%}')
+        print(f'  max(surface, canonical) {combined_correct / len(queries):6.1%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Compare the multi-vector FAQ index with the old one-document-per-FAQ index, and sweep the
+prompt margin and fast-route threshold on held-out queries.
+
+The old index embedded "Question: ...\\nAnswer: ..." once per FAQ with the same
+MiniLM model (Chroma's default embedder) and ranked by cosine similarity; it is
+rebuilt here with numpy so both run on identical vectors. Queries are scored raw,
+without query normalization, so only the index differs.
+
+Needs the full backend requirements (sentence-transformers).
+
+Usage (from wacs-backend/):
+    python benchmarks/retrieval_index.py
+"""
+import os
+import sys
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..'))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from retrieval_queries import HELD_OUT_SET  # noqa: E402
+
+MARGINS = [0.0, 0.04, 0.08, 0.12, 0.16]
+CONFIDENT_SCORES = [0.5, 0.55, 0.6, 0.65, 0.7]
+
+
+def select(scores, margin, keep):
+    """Indices select_prompt_faqs would send: the best FAQ plus runners-up within margin"""
+    order = np.argsort(-scores)[:keep]
+    return [i for i in order if scores[order[0]] - scores[i] <= margin]
+
+
+def main():
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'unused-by-benchmark')
+    from wacs_chatbot import (RAG_MAX_PROMPT_FAQS, RAG_SCORE_MARGIN, ROUTE_CONFIDENT_SCORE,
+                              embedding_model, rag_system, wacs_faqs)
+
+    documents = [f"Question: {faq['question']}\nAnswer: {faq['answer']}" for faq in wacs_faqs]
+    document_vectors = embedding_model.encode(documents, convert_to_numpy=True, normalize_embeddings=True)
+    queries = [query for query, _ in HELD_OUT_SET]
+    query_vectors = embedding_model.encode(queries, convert_to_numpy=True, normalize_embeddings=True)
+    targets = np.array([next(i for i, faq in enumerate(wacs_faqs) if faq['question'].startswith(expected))
+                        for _, expected in HELD_OUT_SET])
+
+    old_scores = query_vectors @ document_vectors.T
+    new_scores = np.stack([rag_system.score_faqs(query) for query in queries])
+
+    n = len(queries)
+    print(f'{n} held-out queries, {len(wacs_faqs)} FAQs\n')
+    print(f'{"index":<28}{"top-1":>8}{"top-3":>8}')
+    for name, scores in [('question+answer document', old_scores), ('multi-vector max-sim', new_scores)]:
+        ranks = np.argsort(-scores, axis=1)
+        top1 = np.mean(ranks[:, 0] == targets)
+        top3 = np.mean([t in r[:3] for t, r in zip(targets, ranks)])
+        print(f'{name:<28}{top1:8.1%}{top3:8.1%}')
+
+    print(f'\nPrompt selection, multi-vector (RAG_MAX_PROMPT_FAQS={RAG_MAX_PROMPT_FAQS}, '
+          f'current RAG_SCORE_MARGIN={RAG_SCORE_MARGIN}):')
+    print(f'{"margin":>8}{"answer in prompt":>18}{"avg FAQs":>10}')
+    for margin in MARGINS:
+        picks = [select(s, margin, RAG_MAX_PROMPT_FAQS) for s in new_scores]
+        recall = np.mean([t in p for t, p in zip(targets, picks)])
+        print(f'{margin:8.2f}{recall:18.1%}{np.mean([len(p) for p in picks]):10.2f}')
+
+    print(f'\nFast route (one FAQ in the prompt and top score >= threshold, '
+          f'current ROUTE_CONFIDENT_SCORE={ROUTE_CONFIDENT_SCORE}):')
+    print(f'{"threshold":>9}{"routed fast":>13}{"fast top-1":>12}')
+    picks = [select(s, RAG_SCORE_MARGIN, RAG_MAX_PROMPT_FAQS) for s in new_scores]
+    for threshold in CONFIDENT_SCORES:
+        fast = [len(p) == 1 and s[p[0]] >= threshold for s, p in zip(new_scores, picks)]
+        fast_correct = [p[0] == t for p, t, f in zip(picks, targets, fast) if f]
+        accuracy = f'{np.mean(fast_correct):12.1%}' if fast_correct else f'{"-":>12}'
+        print(f'{threshold:9.2f}{np.mean(fast):13.1%}{accuracy}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Held-out retrieval queries shared by the benchmarks.
+
+Written separately from the FAQ paraphrases, the synonym tables in
+query_normalizer.py and the TEST_SET in query_normalization.py, so nothing
+here was tuned against. Several use real words the FAQs never mention
+("excess", "reduced", "minister", "wait") to catch spell-correction misfires.
+"""
+
+# (user message, start of the FAQ question it should retrieve)
+HELD_OUT_SET = [
+    ("please stop the excess deduction on my salary", "How can I effect stoppage"),
+    ("i want the monthly loan deduction removed from my pay", "How can I effect stoppage"),
+    ("explain WACS to me", "What is WACS?"),
+    ("what kind of platform is wacs", "What is WACS?"),
+    ("i need a clearance letter showing i owe nothing", "How can I get a Letter of Non-Indebtedness?"),
+    ("who issues the non-indebtedness letter", "How can I get a Letter of Non-Indebtedness?"),
+    ("can i borrow money directly from ippis", "Does IPPIS give out loans?"),
+    ("is ippis the one giving out these loans", "Does IPPIS give out loans?"),
+    ("my loan deduction is not on my payslip where is it", "Where can I see my loan deduction?"),
+    ("where will i see how much was deducted for my loan", "Where can I see my loan deduction?"),
+    ("they took too much money i want it returned", "How can I get my refund?"),
+    ("how do i get back money that was wrongly taken", "How can I get my refund?"),
+    ("i cant find my pay slip for march", "Where can I get my payslip?"),
+    ("how do i view my monthly payslip", "Where can I get my payslip?"),
+    ("the amount that entered my account is lower than the net pay on my payslip",
+     "My net pay is different"),
+    ("payslip net pay and bank credit dont match", "My net pay is different"),
+    ("send me my loan account statement", "How can I get my loan statement?"),
+    ("i need a record of all my loan repayments", "How can I get my loan statement?"),
+    ("money entered my account from wacs but i didnt apply", "I did not request for a loan, but I was credited"),
+    ("how do i return a loan i never asked for", "I did not request for a loan, but I was credited"),
+    ("i cleared my loan last year but they still deduct", "I have liquidated my loan"),
+    ("loan fully repaid why is there still a deduction", "I have liquidated my loan"),
+    ("my salary was reduced this month without explanation", "I was short-paid"),
+    ("they paid me less than my normal salary", "I was short-paid"),
+    ("still waiting for the loan i requested on the mobile app", "I applied for a loan through the IPPIS-OAGF Mobile"),
+    ("applied on the ippis app two days ago nothing yet", "I applied for a loan through the IPPIS-OAGF Mobile"),
+    ("the bank approved my loan on wacs but has not paid", "I applied for a loan through a registered lender"),
+    ("lender on the wacs platform is delaying my loan", "I applied for a loan through a registered lender"),
+    ("how much is left on my loan", "How can I check my loan balance?"),
+    ("what is my outstanding loan", "How can I check my loan balance?"),
+    ("am i qualified to get a loan", "Who can apply for a loan"),
+    ("who is allowed to use the ippis oagf app for loans", "Who can apply for a loan"),
+    ("what is the highest amount i can borrow", "How much can I borrow"),
+    ("how big a loan can i get with my salary", "How much can I borrow"),
+    ("how much interest will i pay", "What is the interest rate"),
+    ("what percentage do lenders charge", "What is the interest rate"),
+    ("can i extend my loan tenure after it has been approved", "Can I change the repayment schedule"),
+    ("i want to pay over a longer period now", "Can I change the repayment schedule"),
+    ("i work for a private company can i get this loan", "Can I apply for a loan through the IPPIS-OAGF Application if I am not"),
+    ("is the loan only for federal civil servants", "Can I apply for a loan through the IPPIS-OAGF Application if I am not"),
+    ("how will the loan be paid back", "How do I repay my loan?"),
+    ("is repayment taken from my salary", "How do I repay my loan?"),
+    ("when is the first repayment due", "When do I start repaying my loan?"),
+    ("how long before they start deducting for the loan", "When do I start repaying my loan?"),
+    ("will the loan come into my salary account", "Which account will my loan be paid into?"),
+    ("which bank account receives the loan money", "Which account will my loan be paid into?"),
+    ("what is the ippis customer care line", "How can I contact IPPIS Support?"),
+    ("how do i reach ippis", "How can I contact IPPIS Support?"),
+    ("what is CTLS and COOP on my payslip", "How can I differentiate"),
+    ("how do i know if a deduction is remita or wacs", "How can I differentiate"),
+    ("there is a loan deduction but i never borrowed", "I didn't request a loan but was erroneously deducted?"),
+    ("i am being deducted for a loan that is not mine", "I didn't request a loan but was erroneously deducted?"),
+    ("where can i find the lenders phone numbers", "How can I get Lenders Contact Information?"),
+    ("how do i contact the company that gave me the loan", "How can I get Lenders Contact Information?"),
+    ("i want to apply for a loan", "How can I request for a loan?"),
+    ("steps to borrow through the app", "How can I request for a loan?"),
+    ("my phone number on ippis is old", "How can I update my phone number?"),
+    ("i lost my sim and need to change my number", "How can I update my phone number?"),
+    ("my salary has not been paid yet this month", "I have not received my salary for this Month?"),
+    ("no salary alert this month", "I have not received my salary for this Month?"),
+    ("i got married and want my new surname on my records", "I would like to update my maiden name"),
+    ("how do i change my name after my wedding", "I would like to update my maiden name"),
+    ("i changed banks how do i update my salary account", "How can I change my Account details on my Payslip?"),
+    ("my payslip shows my old bank account", "How can I change my Account details on my Payslip?"),
+    ("my birth date on record is wrong", "How can I change my date of birth?"),
+    ("correct my age on ippis", "How can I change my date of birth?"),
+    ("why did my monthly loan deduction go up", "I experienced an increase in my loan deduction?"),
+    ("the loan deduction is bigger than before", "I experienced an increase in my loan deduction?"),
+]
@@ -0,0 +1,299 @@
+"""In-memory conversation store with compact message records and idle-history compression"""
+import bisect
+import marshal
+import os
+import sys
+import threading
+import time
+import zlib
+from threading import Lock
+from typing import Dict, List, Tuple
+
+try:
+    import zstandard  # Optional: faster and tighter than zlib for idle histories
+except ImportError:
+    zstandard = None
+
+# Keep only the last 10 messages per conversation to avoid token limits
+MAX_MESSAGES = 10
+
+
+class Message:
+    """Compact chat message: interned role, text content, integer timestamp and retrieved FAQs"""
+    __slots__ = ('role', 'content', 'timestamp', 'faqs')
+
+    def __init__(self, role: str, content: str, timestamp: float = None, faqs: Tuple[str, ...] = None):
+        self.role = sys.intern(role)
+        self.content = content
+        self.timestamp = int(time.time() if timestamp is None else timestamp)
+        self.faqs = faqs  # Questions of the FAQs retrieved for this reply, if any
+
+    def to_dict(self, include_faqs: bool = False) -> Dict:
+        data = {'role': self.role, 'content': self.content, 'timestamp': self.timestamp}
+        if include_faqs and self.faqs is not None:
+            data['faqs'] = list(self.faqs)
+        return data
+
+
+class HistoryCodec:
+    """Pack message lists into compressed bytes using a shared dictionary of typical bot replies"""
+
+    # zlib preset dictionaries are capped at 32KB; zstd raw-content dictionaries share the cap for parity
+    MAX_DICTIONARY_BYTES = 32 * 1024
+
+    def __init__(self, samples: List[str] = None, level: int = 3):
+        # Matches favour the end of the dictionary, so the most common text should go last
+        self.dictionary = "\n".join(samples or []).encode('utf-8')[-self.MAX_DICTIONARY_BYTES:]
+        self.level = level
+        self.backend = 'zstd' if zstandard is not None else 'zlib'
+        if zstandard is not None:
+            zdict = None
+            if self.dictionary:
+                zdict = zstandard.ZstdCompressionDict(self.dictionary, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+            self.compressor = zstandard.ZstdCompressor(level=level, dict_data=zdict, write_checksum=False)
+            self.decompressor = zstandard.ZstdDecompressor(dict_data=zdict)
+
+    def pack(self, messages: List[Message]) -> bytes:
+        raw = marshal.dumps([(m.role, m.timestamp, m.content, m.faqs) for m in messages])
+        if self.backend == 'zstd':
+            return self.compressor.compress(raw)
+        # Raw deflate (negative wbits) skips the zlib header and checksum
+        if self.dictionary:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, zdict=self.dictionary)
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        return compressor.compress(raw) + compressor.flush()
+
+    def unpack(self, packed: bytes) -> List[Message]:
+        if self.backend == 'zstd':
+            raw = self.decompressor.decompress(packed)
+        else:
+            if self.dictionary:
+                decompressor = zlib.decompressobj(-15, zdict=self.dictionary)
+            else:
+                decompressor = zlib.decompressobj(-15)
+            raw = decompressor.decompress(packed) + decompressor.flush()
+        return [Message(role, content, timestamp, faqs) for role, timestamp, content, faqs in marshal.loads(raw)]
+
+
+class ConversationManager:
+    """Manage conversation state including user names and message history"""
+
+    def __init__(self, compress_after: float = 600, codec: HistoryCodec = None):
+        self.conversations = {}
+        self.lock = Lock()
+        # Histories idle for this many seconds are compressed until next read
+        self.compress_after = compress_after
+        self.codec = codec or HistoryCodec()
+        self.maintenance_thread = None
+        self.maintenance_settings = None  # (interval, max_age_hours) once start_maintenance was called
+        self.maintenance_pid = None  # Process the maintenance thread runs in
+        # (seq, conversation_id) in creation order; export cursors are seq numbers
+        self.next_seq = 0
+        self.export_order = []
+
+    def _messages(self, conv: Dict) -> List[Message]:
+        """Message list for a conversation, inflating a compressed history on first access"""
+        packed = conv.pop('packed_messages', None)
+        if packed is not None:
+            conv['messages'] = self.codec.unpack(packed)
+        return conv['messages']
+
+    def get_or_create_conversation(self, conversation_id: str) -> Dict:
+        """Get or create a conversation"""
+        self.ensure_maintenance()
+        with self.lock:
+            if conversation_id not in self.conversations:
+                self.next_seq += 1
+                self.conversations[conversation_id] = {
+                    'user_name': None,
+                    'created_at': time.time(),
+                    'last_activity': time.time(),
+                    'messages': [],  # 🆕 Added: Store conversation history
+                    'questions': 0,  # User messages ever stored; history itself is capped at MAX_MESSAGES
+                    'seq': self.next_seq
+                }
+                self.export_order.append((self.next_seq, conversation_id))
+            else:
+                self.conversations[conversation_id]['last_activity'] = time.time()
+            return self.conversations[conversation_id]
+
+    def set_user_name(self, conversation_id: str, name: str):
+        """Set user name for a conversation"""
+        with self.lock:
+            if conversation_id in self.conversations:
+                self.conversations[conversation_id]['user_name'] = name
+                self.conversations[conversation_id]['last_activity'] = time.time()
+
+    def get_user_name(self, conversation_id: str) -> str:
+        """Get user name for a conversation"""
+        with self.lock:
+            conv = self.conversations.get(conversation_id)
+            return conv['user_name'] if conv else None
+
+    def add_message(self, conversation_id: str, role: str, content: str, faqs: Tuple[str, ...] = None):
+        """🆕 Added: Add a message to conversation history"""
+        with self.lock:
+            conv = self.conversations.get(conversation_id)
+            if conv is not None:
+                messages = self._messages(conv)
+                messages.append(Message(role, content, faqs=faqs))
+                if role == 'user':
+                    conv['questions'] += 1
+                if len(messages) > MAX_MESSAGES:
+                    del messages[:-MAX_MESSAGES]
+                conv['last_activity'] = time.time()
+
+    def remove_message(self, conversation_id: str, role: str, content: str) -> bool:
+        """Drop the most recent message with this role and content, e.g. a question that was never answered"""
+        with self.lock:
+            conv = self.conversations.get(conversation_id)
+            if conv is None:
+                return False
+            messages = self._messages(conv)
+            for i in range(len(messages) - 1, -1, -1):
+                if messages[i].role == role and messages[i].content == content:
+                    del messages[i]
+                    if role == 'user':
+                        conv['questions'] -= 1
+                    return True
+            return False
+
+    def get_question_count(self, conversation_id: str) -> int:
+        """Number of user messages stored in the conversation, including ones trimmed from history"""
+        with self.lock:
+            conv = self.conversations.get(conversation_id)
+            return conv['questions'] if conv else 0
+
+    def get_conversation_history(self, conversation_id: str, max_messages: int = 10) -> List[Dict]:
+        """🆕 Added: Get conversation history"""
+        with self.lock:
+            conv = self.conversations.get(conversation_id)
+            if conv:
+                return [m.to_dict() for m in self._messages(conv)[-max_messages:]]
+            return []
+
+    def get_full_conversation(self, conversation_id: str) -> Dict:
+        """🆕 NEW: Get full conversation data including all messages"""
+        with self.lock:
+            conv = self.conversations.get(conversation_id)
+            if conv:
+                return {
+                    'user_name': conv.get('user_name'),
+                    'messages': [m.to_dict() for m in self._messages(conv)],
+                    'created_at': conv.get('created_at'),
+                    'last_activity': conv.get('last_activity')
+                }
+            return None
+
+    def cleanup_old_conversations(self, max_age_hours: int = 24):
+        """Clean up conversations older than max_age_hours"""
+        with self.lock:
+            current_time = time.time()
+            to_remove = []
+            for conv_id, conv_data in self.conversations.items():
+                if current_time - conv_data['last_activity'] > max_age_hours * 3600:
+                    to_remove.append(conv_id)
+
+            for conv_id in to_remove:
+                del self.conversations[conv_id]
+            if to_remove:
+                self.export_order = [(seq, cid) for seq, cid in self.export_order
+                                     if cid in self.conversations and self.conversations[cid]['seq'] == seq]
+
+    def export_batch(self, cursor: int = 0, since: float = None, batch_size: int = 200,
+                     include_faqs: bool = False) -> Tuple[List[Dict], int, bool]:
+        """Snapshot the next batch of conversations created after cursor.
+
+        Only the copy happens under the lock; compressed histories are inflated afterwards.
+        Returns (records, next_cursor, done).
+        """
+        with self.lock:
+            start = bisect.bisect_right(self.export_order, cursor, key=lambda entry: entry[0])
+            window = self.export_order[start:start + batch_size]
+            snapshot = []
+            for seq, conv_id in window:
+                conv = self.conversations.get(conv_id)
+                if conv is None or conv['seq'] != seq:
+                    continue
+                if since is not None and conv['last_activity'] < since:
+                    continue
+                snapshot.append((seq, conv_id, conv['user_name'], conv['created_at'], conv['last_activity'],
+                                 conv.get('packed_messages'), list(conv.get('messages', ()))))
+            next_cursor = window[-1][0] if window else cursor
+            done = start + batch_size >= len(self.export_order)
+
+        records = []
+        for seq, conv_id, user_name, created_at, last_activity, packed, messages in snapshot:
+            if packed is not None:
+                messages = self.codec.unpack(packed)
+            records.append({
+                'conversation_id': conv_id,
+                'cursor': seq,
+                'user_name': user_name,
+                'created_at': created_at,
+                'last_activity': last_activity,
+                'messages': [m.to_dict(include_faqs) for m in messages]
+            })
+        return records, next_cursor, done
+
+    def compress_idle_conversations(self) -> int:
+        """Compress histories idle longer than compress_after; returns how many were packed"""
+        cutoff = time.time() - self.compress_after
+        with self.lock:
+            idle = [cid for cid, conv in self.conversations.items()
+                    if conv['last_activity'] < cutoff and conv.get('messages')]
+
+        # Take the lock per conversation so live traffic never waits on the whole sweep
+        compressed = 0
+        for conv_id in idle:
+            with self.lock:
+                conv = self.conversations.get(conv_id)
+                if conv is None or conv['last_activity'] >= cutoff or not conv.get('messages'):
+                    continue
+                conv['packed_messages'] = self.codec.pack(conv.pop('messages'))
+                compressed += 1
+        return compressed
+
+    def start_maintenance(self, interval: float = 60, max_age_hours: int = 24):
+        """Expire old conversations and compress idle ones on a background thread.
+
+        Threads do not survive fork, so under gunicorn --preload each worker starts
+        its own thread on its first conversation (see ensure_maintenance).
+        """
+        self.maintenance_settings = (interval, max_age_hours)
+        self.ensure_maintenance()
+
+    def ensure_maintenance(self):
+        """Start the maintenance thread in this process if it was requested but is not running here"""
+        if self.maintenance_settings is None or self.maintenance_pid == os.getpid():
+            return
+        with self.lock:
+            if self.maintenance_pid == os.getpid():
+                return
+            self.maintenance_pid = os.getpid()
+        interval, max_age_hours = self.maintenance_settings
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.cleanup_old_conversations(max_age_hours)
+                    self.compress_idle_conversations()
+                except Exception as e:
+                    print(f"❌ Error in conversation maintenance: {e}")
+
+        self.maintenance_thread = threading.Thread(target=run, name="wacs-conversation-maintenance", daemon=True)
+        self.maintenance_thread.start()
+
+    def get_stats(self) -> Dict:
+        """Counts used to track memory growth of the conversation store"""
+        with self.lock:
+            packed = [c['packed_messages'] for c in self.conversations.values() if 'packed_messages' in c]
+            return {
+                'conversations': len(self.conversations),
+                'live_messages': sum(len(c.get('messages', ())) for c in self.conversations.values()),
+                'compressed_conversations': len(packed),
+                'compressed_bytes': sum(len(p) for p in packed),
+                'codec': self.codec.backend
+            }
@@ -0,0 +1,367 @@
+"""Host-level embedding sidecar: load the model once and serve every worker over a Unix socket.
+
+Run it next to the workers and point them at the same socket:
+    python embedding_service.py --socket /tmp/wacs-embed.sock
+    EMBEDDING_SOCKET=/tmp/wacs-embed.sock gunicorn -w 4 wacs_chatbot:app
+
+gunicorn --preload is supported: a connection opened in the master is never
+reused by the forked workers, each worker connects on its first request.
+
+Wire format (little-endian, one request/response at a time per connection):
+    request  = b"E" | flags:u8 | count:u32 | (length:u32 | utf-8 text) * count
+    response = status:u8 (0) | rows:u32 | dim:u32 | float32[rows * dim]
+             | status:u8 (1) | length:u32 | utf-8 error message
+flags bit 0 asks for L2-normalized embeddings. A status 1 reply leaves the
+connection usable; the server only hangs up on a malformed request.
+"""
+import argparse
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from threading import Lock
+from typing import List
+
+import numpy as np
+
+DEFAULT_MODEL = 'all-MiniLM-L6-v2'
+MAGIC = b'E'
+FLAG_NORMALIZE = 0x01
+STATUS_OK = 0
+STATUS_ERROR = 1
+MAX_TEXTS = 1024
+MAX_TEXT_BYTES = 64 * 1024
+
+REQUEST_HEADER = struct.Struct('<cBI')
+LENGTH = struct.Struct('<I')
+RESPONSE_HEADER = struct.Struct('<BII')
+
+
+class EmbeddingServiceError(Exception):
+    """The sidecar answered with an error or broke the protocol"""
+
+
+class EmbeddingRequestError(EmbeddingServiceError):
+    """The sidecar refused or failed one request; the connection is still in sync"""
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            raise ConnectionError("Embedding socket closed mid-message")
+        received += n
+    return bytes(buf)
+
+
+def _discard_exact(sock: socket.socket, size: int):
+    while size > 0:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            raise ConnectionError("Embedding socket closed mid-message")
+        size -= len(chunk)
+
+
+def encode_request(texts: List[str], normalize: bool) -> bytes:
+    parts = [REQUEST_HEADER.pack(MAGIC, FLAG_NORMALIZE if normalize else 0, len(texts))]
+    for text in texts:
+        data = text.encode('utf-8')
+        if len(data) > MAX_TEXT_BYTES:
+            # The model only reads the first 256 tokens, so long texts are cut rather than refused
+            data = data[:MAX_TEXT_BYTES].decode('utf-8', 'ignore').encode('utf-8')
+        parts.append(LENGTH.pack(len(data)))
+        parts.append(data)
+    return b''.join(parts)
+
+
+def read_request(sock: socket.socket):
+    """Return (texts, normalize) or raise ConnectionError on EOF.
+
+    Oversized texts are read to the end before EmbeddingRequestError is raised,
+    so the next request on the connection still parses.
+    """
+    magic, flags, count = REQUEST_HEADER.unpack(_recv_exact(sock, REQUEST_HEADER.size))
+    if magic != MAGIC or count > MAX_TEXTS:
+        raise EmbeddingServiceError("Malformed embedding request")
+    texts = []
+    too_long = False
+    for _ in range(count):
+        (length,) = LENGTH.unpack(_recv_exact(sock, LENGTH.size))
+        if length > MAX_TEXT_BYTES:
+            _discard_exact(sock, length)
+            too_long = True
+        else:
+            texts.append(_recv_exact(sock, length).decode('utf-8', 'replace'))
+    if too_long:
+        raise EmbeddingRequestError("Text too long")
+    return texts, bool(flags & FLAG_NORMALIZE)
+
+
+def encode_response(vectors: np.ndarray) -> bytes:
+    vectors = np.ascontiguousarray(vectors, dtype='<f4')
+    rows, dim = vectors.shape
+    return RESPONSE_HEADER.pack(STATUS_OK, rows, dim) + vectors.tobytes()
+
+
+def encode_error(message: str) -> bytes:
+    data = message.encode('utf-8')
+    return struct.pack('<BI', STATUS_ERROR, len(data)) + data
+
+
+def read_response(sock: socket.socket) -> np.ndarray:
+    status = _recv_exact(sock, 1)[0]
+    if status != STATUS_OK:
+        (length,) = LENGTH.unpack(_recv_exact(sock, LENGTH.size))
+        raise EmbeddingRequestError(_recv_exact(sock, length).decode('utf-8', 'replace'))
+    rows, dim = struct.unpack('<II', _recv_exact(sock, 8))
+    return np.frombuffer(_recv_exact(sock, rows * dim * 4), dtype='<f4').reshape(rows, dim)
+
+
+class EmbeddingBatcher:
+    """Coalesce concurrent requests from all workers into shared model.encode batches"""
+
+    def __init__(self, model, max_batch: int = 64, max_wait: float = 0.005):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.jobs = queue.Queue()
+        self.batches = 0
+        self.texts = 0
+        threading.Thread(target=self._run, name="wacs-embedding-batcher", daemon=True).start()
+
+    def submit(self, texts: List[str], normalize: bool) -> np.ndarray:
+        job = {'texts': texts, 'normalize': normalize, 'done': threading.Event(), 'result': None, 'error': None}
+        self.jobs.put(job)
+        job['done'].wait()
+        if job['error'] is not None:
+            raise job['error']
+        return job['result']
+
+    def _run(self):
+        while True:
+            jobs = [self.jobs.get()]
+            pending = len(jobs[0]['texts'])
+            deadline = time.monotonic() + self.max_wait
+            while pending < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    job = self.jobs.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                jobs.append(job)
+                pending += len(job['texts'])
+
+            for normalize in (True, False):
+                group = [job for job in jobs if job['normalize'] == normalize]
+                if group:
+                    self._encode_group(group, normalize)
+
+    def _encode_group(self, group: List[dict], normalize: bool):
+        texts = [text for job in group for text in job['texts']]
+        try:
+            vectors = self.model.encode(
+                texts,
+                batch_size=self.max_batch,
+                convert_to_numpy=True,
+                normalize_embeddings=normalize
+            ).astype(np.float32)
+            offset = 0
+            for job in group:
+                job['result'] = vectors[offset:offset + len(job['texts'])]
+                offset += len(job['texts'])
+            self.batches += 1
+            self.texts += len(texts)
+        except Exception as e:
+            for job in group:
+                job['error'] = e
+        for job in group:
+            job['done'].set()
+
+
+class EmbeddingRequestHandler(socketserver.BaseRequestHandler):
+    """Serve requests on one worker connection until it closes"""
+
+    def handle(self):
+        while True:
+            try:
+                texts, normalize = read_request(self.request)
+            except (ConnectionError, struct.error):
+                return
+            except EmbeddingRequestError as e:
+                self.request.sendall(encode_error(str(e)))
+                continue
+            except EmbeddingServiceError as e:
+                self.request.sendall(encode_error(str(e)))
+                return
+            try:
+                vectors = self.server.batcher.submit(texts, normalize)
+                self.request.sendall(encode_response(vectors))
+            except Exception as e:
+                self.request.sendall(encode_error(f"Embedding failed: {e}"))
+
+
+class EmbeddingServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128  # Every worker thread may connect at once after a restart
+
+    def __init__(self, socket_path: str, batcher: EmbeddingBatcher):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, EmbeddingRequestHandler)
+        os.chmod(socket_path, 0o660)
+        self.batcher = batcher
+
+
+class EmbeddingClient:
+    """SentenceTransformer.encode stand-in that prefers the sidecar and falls back to an in-process model"""
+
+    def __init__(self, model_name: str = DEFAULT_MODEL, socket_path: str = None,
+                 timeout: float = 5.0, retry_after: float = 30.0):
+        self.model_name = model_name
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.local = threading.local()  # One connection per worker thread
+        self.pid = os.getpid()  # Process that owns the connections in self.local
+        self.fork_lock = Lock()
+        self.model = None
+        self.model_lock = Lock()
+        self.sidecar_down_until = 0.0
+        self.stats_lock = Lock()
+        self.remote_calls = 0
+        self.local_calls = 0
+        self.failures = 0
+        self.request_errors = 0
+
+    def _connection(self) -> socket.socket:
+        if self.pid != os.getpid():
+            with self.fork_lock:
+                if self.pid != os.getpid():
+                    # Forked after connecting: drop (not close) the parent's sockets, the parent may still use them
+                    self.local = threading.local()
+                    self.pid = os.getpid()
+        sock = getattr(self.local, 'sock', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self.local.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self.local, 'sock', None)
+        self.local.sock = None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def wait_for_sidecar(self, timeout: float) -> bool:
+        """Block until the sidecar accepts connections, so startup does not load a local model needlessly"""
+        if not self.socket_path:
+            return False
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self._connection()
+                return True
+            except OSError:
+                self._close()
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.2)
+
+    def _local_model(self):
+        """Load the model in this process only when the sidecar cannot be used"""
+        if self.model is None:
+            with self.model_lock:
+                if self.model is None:
+                    from sentence_transformers import SentenceTransformer
+                    self.model = SentenceTransformer(self.model_name)
+        return self.model
+
+    def encode(self, sentences, batch_size: int = 32, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        vectors = None
+
+        if self.socket_path and time.monotonic() >= self.sidecar_down_until:
+            try:
+                sock = self._connection()
+                # Large index builds are chunked to stay under the server's per-request cap
+                chunks = []
+                for start in range(0, len(texts), MAX_TEXTS):
+                    sock.sendall(encode_request(texts[start:start + MAX_TEXTS], normalize_embeddings))
+                    chunks.append(read_response(sock))
+                vectors = np.concatenate(chunks) if len(chunks) > 1 else chunks[0]
+                with self.stats_lock:
+                    self.remote_calls += 1
+            except EmbeddingRequestError:
+                # The sidecar is up and the connection in sync; loading the model here would not help
+                with self.stats_lock:
+                    self.request_errors += 1
+                raise
+            except (OSError, struct.error, EmbeddingServiceError) as e:
+                self._close()
+                self.sidecar_down_until = time.monotonic() + self.retry_after
+                with self.stats_lock:
+                    self.failures += 1
+                print(f"⚠️ Embedding sidecar unavailable, using in-process model: {e}")
+
+        if vectors is None:
+            vectors = self._local_model().encode(
+                texts,
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=normalize_embeddings
+            )
+            with self.stats_lock:
+                self.local_calls += 1
+
+        return vectors[0] if single else vectors
+
+    def get_stats(self) -> dict:
+        with self.stats_lock:
+            return {
+                'sidecar': self.socket_path,
+                'remote_calls': self.remote_calls,
+                'local_calls': self.local_calls,
+                'sidecar_failures': self.failures,
+                'sidecar_request_errors': self.request_errors,
+                'local_model_loaded': self.model is not None
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WACS shared embedding sidecar")
+    parser.add_argument('--socket', default=os.getenv('EMBEDDING_SOCKET', '/tmp/wacs-embed.sock'))
+    parser.add_argument('--model', default=os.getenv('EMBEDDING_MODEL', DEFAULT_MODEL))
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(args.model)
+    batcher = EmbeddingBatcher(model, max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000)
+    server = EmbeddingServer(args.socket, batcher)
+    print(f"🧠 Embedding sidecar serving {args.model} on {args.socket}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Canonicalize user queries before retrieval: Unicode cleanup, domain synonyms and spell correction"""
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Set
+
+try:
+    from wordfreq import zipf_frequency  # Optional: general English frequencies keep real words uncorrected
+except ImportError:
+    zipf_frequency = None
+
+# Multi-word phrasing mapped to the wording used in wacs_faqs (applied before tokenizing)
+PHRASE_SYNONYMS = {
+    r"\bshort[\s-]?paid\b": "short-paid",
+    r"\bnon[\s-]?indebted(?:ness)?\b": "non-indebtedness",
+    r"\bpay[\s-]?slip\b": "payslip",
+    r"\bdesk[\s-]?officer\b": "desk officer",
+    r"\bdate of birth\b|\bd\.?o\.?b\b": "date of birth",
+    r"\ba/c\b": "account",
+    r"\bi\.?p\.?p\.?i\.?s\b": "ippis",
+    r"\boagf\s+app\b": "ippis-oagf application",
+    r"\btake\s+(?:a\s+)?loan\b": "request loan",
+    # Pidgin verbs only in the positions they are used, so "does it fit" or "I'm fed up" stay intact
+    r"\b(i|we|you|who|una|dem) fit\b": r"\1 can",
+    r"\b(i|we|dem|e) don\b": r"\1 have",
+    r"\bfed(?:eral)?\s+(?:govt|government)\b": "federal government",
+}
+
+# Single-token slang, abbreviations and acronyms
+TOKEN_SYNONYMS = {
+    "pls": "please", "plz": "please", "abeg": "please", "biko": "please",
+    "wetin": "what", "dey": "is", "una": "you", "sef": "",
+    "salo": "salary", "sal": "salary",
+    "acct": "account", "acc": "account", "bal": "balance", "amt": "amount",
+    "govt": "government", "fg": "federal government",
+    "mfb": "microfinance bank", "coop": "cooperative coop",
+    "stmt": "statement", "bvn": "bank verification number",
+    "deductions": "deduction", "loans": "loan", "lenders": "lender",
+    "u": "you", "ur": "your", "im": "i am", "dont": "do not", "didnt": "did not",
+    "wat": "what", "wan": "want", "dem": "they", "wey": "that",
+    "numba": "number", "diff": "difference", "info": "information",
+}
+
+# Words at least this common in general English (Zipf scale: 3 = once per million words) are never
+# corrected; real words sit above it ("excess" 4.2, "arrears" 3.05), typos below ("diferent" 2.0)
+ENGLISH_WORD_ZIPF = 3.0
+
+# Frequent words that never need correcting, even though they are absent from the FAQs
+# (the only guard when wordfreq is not installed)
+COMMON_WORDS = {
+    "please", "hello", "thanks", "thank", "today", "month", "week", "since", "still", "already",
+    "money", "yet", "again", "ongoing", "paid", "wrong", "help", "name", "need", "want",
+    "collect", "receive", "finish", "deduct", "disburse", "marry", "married", "surname", "phone",
+    "number", "borrow", "owe", "mean", "start", "back", "yesterday", "never", "late",
+}
+
+# A vocabulary word with one of these endings is an inflection, not a typo ("deducting", "repaying")
+INFLECTION_SUFFIXES = ("ing", "ed", "es", "s")
+
+EMAIL_PATTERN = re.compile(r"[a-z0-9._%+-]+@[a-z0-9.-]+\.[a-z]{2,}")
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+
+
+def is_english_word(word: str) -> bool:
+    """Common general-English word according to wordfreq, if it is installed"""
+    # The "small" list stops at Zipf 3, exactly the threshold, and costs ~12MB instead of ~45MB
+    return zipf_frequency is not None and zipf_frequency(word, "en", wordlist="small") >= ENGLISH_WORD_ZIPF
+
+
+def damerau_levenshtein(a: str, b: str, max_distance: int) -> int:
+    """Optimal string alignment distance, returning max_distance + 1 once exceeded"""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = current[0]
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+            row_min = min(row_min, current[j])
+        if row_min > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+class SymSpellIndex:
+    """SymSpell-style corrector: precomputed deletes map back to vocabulary words"""
+
+    def __init__(self, word_counts: Counter, max_distance: int = 2, min_length: int = 4, min_count: int = 2):
+        self.word_counts = word_counts
+        self.max_distance = max_distance
+        self.min_length = min_length
+        self.deletes: Dict[str, Set[str]] = {}
+        # Rare vocabulary words are poor correction targets, so only frequent ones are indexed
+        for word in (w for w, count in word_counts.items() if count >= min_count):
+            for variant in self._deletes(word, self._allowed_distance(word)):
+                self.deletes.setdefault(variant, set()).add(word)
+
+    def _allowed_distance(self, word: str) -> int:
+        # Short words have too many neighbours to correct safely
+        return 1 if len(word) < 6 else self.max_distance
+
+    @staticmethod
+    def _deletes(word: str, distance: int) -> Set[str]:
+        results = {word}
+        frontier = {word}
+        for _ in range(distance):
+            frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w)) if len(w) > 1}
+            results |= frontier
+        return results
+
+    def _inflects_known_word(self, word: str) -> bool:
+        for suffix in INFLECTION_SUFFIXES:
+            if word.endswith(suffix) and len(word) > len(suffix) + 2:
+                stem = word[:-len(suffix)]
+                # "disbursed" -> "disburse", "stopped" -> "stop"
+                stems = (stem, stem + "e", stem[:-1] if stem[-1] == stem[-2] else stem)
+                if any(s in self.word_counts for s in stems):
+                    return True
+        return False
+
+    def correct(self, word: str) -> str:
+        """Closest vocabulary word (ties broken by frequency), or the word itself"""
+        if word in self.word_counts or len(word) < self.min_length or not word.isalpha():
+            return word
+        if is_english_word(word) or self._inflects_known_word(word):
+            return word
+        distance = self._allowed_distance(word)
+        best, best_key = word, None
+        for variant in self._deletes(word, distance):
+            for candidate in self.deletes.get(variant, ()):
+                d = damerau_levenshtein(word, candidate, distance)
+                if d > distance:
+                    continue
+                key = (d, -self.word_counts[candidate])
+                if best_key is None or key < best_key:
+                    best, best_key = candidate, key
+        return best
+
+
+class QueryNormalizer:
+    """Turn raw user text into the surface and canonical forms used for retrieval.
+
+    Spell correction can rewrite correctly spelled words outside the FAQ vocabulary,
+    so retrieval scores the surface form alongside the canonical query.
+    """
+
+    def __init__(self, faqs: List[Dict], max_edit_distance: int = 2):
+        self.phrase_patterns = [(re.compile(p), r) for p, r in PHRASE_SYNONYMS.items()]
+        word_counts = Counter()
+        for faq in faqs:
+            for text in [faq['question'], faq['answer']] + faq.get('paraphrases', []):
+                word_counts.update(TOKEN_PATTERN.findall(self.clean_text(text)))
+        for word in COMMON_WORDS:
+            word_counts[word] += 1
+        self.spell = SymSpellIndex(word_counts, max_distance=max_edit_distance)
+
+    @staticmethod
+    def clean_text(text: str) -> str:
+        """Unicode compatibility folding, accent stripping, lowercasing and whitespace cleanup"""
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(ch for ch in text if not unicodedata.combining(ch) and unicodedata.category(ch) != "Cf")
+        text = text.casefold().replace("’", "'").replace("‘", "'")
+        # Payslip codes like COOP/CTLS and WACS-LENDER are separate labels
+        text = re.sub(r"(?<=[a-z]{2})[/\\|](?=[a-z]{2})", " ", text)
+        return re.sub(r"\s+", " ", text).strip()
+
+    def surface(self, query: str) -> str:
+        """Cleaned query tokens without synonyms or spell correction"""
+        return " ".join(TOKEN_PATTERN.findall(self.clean_text(query)))
+
+    def normalize(self, query: str) -> str:
+        """Canonical form of a query; identical questions map to identical strings"""
+        text = self.clean_text(query)
+        emails = EMAIL_PATTERN.findall(text)
+        text = EMAIL_PATTERN.sub(" ", text)
+        for pattern, replacement in self.phrase_patterns:
+            text = pattern.sub(replacement, text)
+
+        tokens = []
+        for token in TOKEN_PATTERN.findall(text):
+            token = token.replace("'", "")
+            if token not in TOKEN_SYNONYMS:
+                token = self.spell.correct(token)
+            mapped = TOKEN_SYNONYMS.get(token, token)
+            tokens.extend(mapped.split())
+        return " ".join(tokens + emails)
@@ -1,16 +1,35 @@
-from flask import Flask, request, jsonify, send_from_directory, session, send_file
+from flask import Flask, request, jsonify, send_from_directory, session, send_file, g, Response
 import os
 from anthropic import Anthropic  # ✅ Changed from Groq
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
-import chromadb
-from sentence_transformers import SentenceTransformer
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 import uuid
 import re
 import time
-from threading import Lock
+import math
+import json
+import io
+import sys
+import hmac
+import marshal
+import cProfile
+import pstats
+import threading
+import tracemalloc
+from collections import OrderedDict, Counter, deque
+from contextlib import contextmanager
+from threading import Lock, Condition
+from conversation_store import ConversationManager, HistoryCodec
+from query_normalizer import QueryNormalizer
+from embedding_service import EmbeddingClient
+
+try:
+    import redis  # Optional: shared rate-limit state for multi-instance deployments
+except ImportError:
+    redis = None
 
 # Load environment variables
 load_dotenv()
@@ -24,111 +43,487 @@ app.secret_key = os.environ.get(
     "dev-secret"  # fallback for local dev
 )
 CORS(app)
+# Number of reverse proxies in front of the app (Cloud Run's front end counts as one).
+# ProxyFix then takes the client address that many hops from the right of X-Forwarded-For,
+# so a client-supplied header cannot pick its own rate-limit bucket.
+TRUSTED_PROXY_COUNT = int(os.getenv("TRUSTED_PROXY_COUNT", "0"))
+if TRUSTED_PROXY_COUNT > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_COUNT)
+elif os.getenv("K_SERVICE"):
+    # Cloud Run sets K_SERVICE; without ProxyFix every user shares the front end's address
+    print("⚠️ Running on Cloud Run with TRUSTED_PROXY_COUNT=0: all clients share one rate-limit bucket")
 
 
 # In-memory conversation store
 conversations = {}
 conversations_lock = Lock()
 
-class ConversationManager:
-    """Manage conversation state including user names and message history"""
-    
-    def __init__(self):
-        self.conversations = {}
+# ==========================================================
+# 🚦 Rate limiting and fair LLM scheduling
+# ==========================================================
+
+def _env_float(name: str, default: float) -> float:
+    """Read a float setting from the environment, falling back to default"""
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+# Token-bucket limits: RATE is tokens refilled per second, BURST is bucket size
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() != "false"
+RATE_LIMITS = {
+    "ip": (_env_float("RATE_LIMIT_IP_RATE", 0.5), _env_float("RATE_LIMIT_IP_BURST", 20)),
+    "conversation": (_env_float("RATE_LIMIT_CONVERSATION_RATE", 0.2), _env_float("RATE_LIMIT_CONVERSATION_BURST", 8)),
+}
+# Bucket cost per endpoint; /chat hits the LLM so it costs the most
+ENDPOINT_COSTS = {
+    "chat": _env_float("RATE_LIMIT_CHAT_COST", 1.0),
+    "search": _env_float("RATE_LIMIT_SEARCH_COST", 0.5),
+    "process_text": _env_float("RATE_LIMIT_PROCESS_TEXT_COST", 0.25),
+}
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL")
+# After a Redis error, skip it for this long and use local buckets
+RATE_LIMIT_REDIS_RETRY_AFTER = _env_float("RATE_LIMIT_REDIS_RETRY_AFTER", 30)
+
+# Shared LLM concurrency, split fairly across clients
+LLM_MAX_CONCURRENCY = int(_env_float("LLM_MAX_CONCURRENCY", 8))
+LLM_QUEUE_TIMEOUT = _env_float("LLM_QUEUE_TIMEOUT", 15)
+
+
+class LLMBusyError(Exception):
+    """Raised when a request could not get an LLM slot in time"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"LLM capacity exhausted, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class InMemoryTokenBucketStore:
+    """Process-local token buckets keyed by scope and client"""
+
+    def __init__(self, prune_every: int = 1000):
+        self.buckets = {}  # key -> [tokens, last_refill]
         self.lock = Lock()
-        
-    def get_or_create_conversation(self, conversation_id: str) -> Dict:
-        """Get or create a conversation"""
+        self.prune_every = prune_every
+        self.calls = 0
+
+    def consume(self, key: str, rate: float, burst: float, cost: float) -> Tuple[bool, float]:
+        """Take cost tokens from a bucket; returns (allowed, retry_after_seconds)"""
+        now = time.monotonic()
         with self.lock:
-            if conversation_id not in self.conversations:
-                self.conversations[conversation_id] = {
-                    'user_name': None,
-                    'created_at': time.time(),
-                    'last_activity': time.time(),
-                    'messages': []  # 🆕 Added: Store conversation history
-                }
+            self.calls += 1
+            if self.calls % self.prune_every == 0:
+                self._prune(now)
+
+            tokens, last = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            if tokens >= cost:
+                self.buckets[key] = [tokens - cost, now]
+                return True, 0.0
+            self.buckets[key] = [tokens, now]
+            return False, (cost - tokens) / rate if rate > 0 else 60.0
+
+    def _prune(self, now: float):
+        """Drop buckets that have been idle long enough to be full again"""
+        max_idle = max(burst / rate for rate, burst in RATE_LIMITS.values() if rate > 0)
+        stale = [k for k, (_, last) in self.buckets.items() if now - last > max_idle]
+        for k in stale:
+            del self.buckets[k]
+
+    def size(self) -> int:
+        with self.lock:
+            return len(self.buckets)
+
+
+class RedisTokenBucketStore:
+    """Token buckets shared across instances through Redis"""
+
+    # Refill and consume atomically on the server; floats travel as strings
+    SCRIPT = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 't') or ARGV[2])
+local last = tonumber(redis.call('HGET', KEYS[1], 'ts') or ARGV[4])
+local rate, burst, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+tokens = math.min(burst, tokens + math.max(0, now - last) * rate)
+local allowed, retry = 0, 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+elseif rate > 0 then
+    retry = (cost - tokens) / rate
+else
+    retry = 60
+end
+redis.call('HSET', KEYS[1], 't', tostring(tokens), 'ts', tostring(now))
+if rate > 0 then
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+end
+return {allowed, tostring(retry)}
+"""
+
+    def __init__(self, url: str):
+        self.client = redis.Redis.from_url(url, socket_timeout=0.2)
+        self.script = self.client.register_script(self.SCRIPT)
+
+    def consume(self, key: str, rate: float, burst: float, cost: float) -> Tuple[bool, float]:
+        allowed, retry = self.script(keys=[f"wacs:rl:{key}"], args=[rate, burst, cost, time.time()])
+        return bool(int(allowed)), float(retry)
+
+    def size(self) -> int:
+        return -1  # Not tracked locally
+
+
+class RateLimiter:
+    """Per-IP and per-conversation token-bucket limiter with optional Redis backend"""
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]], redis_url: str = None,
+                 retry_after: float = 30.0):
+        self.limits = limits
+        self.local_store = InMemoryTokenBucketStore()
+        self.shared_store = None
+        self.retry_after = retry_after
+        self.shared_down_until = 0.0
+        if redis_url:
+            if redis is None:
+                print("⚠️ RATE_LIMIT_REDIS_URL set but redis package is not installed; using in-memory limiter")
             else:
-                self.conversations[conversation_id]['last_activity'] = time.time()
-            return self.conversations[conversation_id]
-    
-    def set_user_name(self, conversation_id: str, name: str):
-        """Set user name for a conversation"""
+                try:
+                    self.shared_store = RedisTokenBucketStore(redis_url)
+                    print("✅ Rate limiter using shared Redis backend")
+                except Exception as e:
+                    print(f"⚠️ Could not connect rate limiter to Redis, using in-memory limiter: {e}")
+        self.stats_lock = Lock()
+        self.allowed = 0
+        self.rejected = {scope: 0 for scope in limits}
+        self.backend_errors = 0
+
+    def check(self, scope: str, key: str, cost: float = 1.0) -> Tuple[bool, float]:
+        """Consume from the bucket for (scope, key); returns (allowed, retry_after)"""
+        rate, burst = self.limits[scope]
+        bucket_key = f"{scope}:{key}"
+        allowed, retry_after = None, 0.0
+        if self.shared_store is not None and time.monotonic() >= self.shared_down_until:
+            try:
+                allowed, retry_after = self.shared_store.consume(bucket_key, rate, burst, cost)
+            except Exception as e:
+                # Fall back to local buckets and stop paying the Redis timeout until the cool-down ends
+                self.shared_down_until = time.monotonic() + self.retry_after
+                with self.stats_lock:
+                    self.backend_errors += 1
+                print(f"⚠️ Rate limiter backend error, using in-memory limiter for {self.retry_after:.0f}s: {e}")
+        if allowed is None:
+            allowed, retry_after = self.local_store.consume(bucket_key, rate, burst, cost)
+
+        with self.stats_lock:
+            if allowed:
+                self.allowed += 1
+            else:
+                self.rejected[scope] += 1
+        return allowed, retry_after
+
+    def get_stats(self) -> Dict:
+        with self.stats_lock:
+            return {
+                "enabled": RATE_LIMIT_ENABLED,
+                "backend": "redis" if self.shared_store is not None else "memory",
+                "redis_circuit_open": self.shared_store is not None and time.monotonic() < self.shared_down_until,
+                "limits": {scope: {"rate_per_sec": r, "burst": b} for scope, (r, b) in self.limits.items()},
+                "allowed": self.allowed,
+                "rejected": dict(self.rejected),
+                "backend_errors": self.backend_errors,
+                "local_buckets": self.local_store.size(),
+            }
+
+
+class FairLLMScheduler:
+    """Bound concurrent LLM calls and hand free slots to waiting clients round-robin"""
+
+    def __init__(self, max_concurrency: int, queue_timeout: float):
+        self.max_concurrency = max(1, max_concurrency)
+        self.queue_timeout = queue_timeout
+        self.cond = Condition()
+        self.active = 0
+        self.waiting = OrderedDict()  # client_key -> deque of tickets, in round-robin order
+        self.granted = 0
+        self.timeouts = 0
+
+    def _grant_next(self):
+        """Give a free slot to the head ticket of the next client in rotation"""
+        while self.active < self.max_concurrency and self.waiting:
+            client_key, tickets = next(iter(self.waiting.items()))
+            ticket = tickets.popleft()
+            if tickets:
+                self.waiting.move_to_end(client_key)
+            else:
+                del self.waiting[client_key]
+            ticket["granted"] = True
+            self.active += 1
+        self.cond.notify_all()
+
+    def acquire(self, client_key: str):
+        with self.cond:
+            if self.active < self.max_concurrency and not self.waiting:
+                self.active += 1
+                self.granted += 1
+                return
+
+            ticket = {"granted": False}
+            self.waiting.setdefault(client_key, deque()).append(ticket)
+            deadline = time.monotonic() + self.queue_timeout
+            while not ticket["granted"]:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    tickets = self.waiting.get(client_key)
+                    if tickets is not None:
+                        tickets.remove(ticket)
+                        if not tickets:
+                            del self.waiting[client_key]
+                    self.timeouts += 1
+                    raise LLMBusyError(retry_after=max(1.0, self.queue_timeout / 2))
+                self.cond.wait(remaining)
+            self.granted += 1
+
+    def release(self):
+        with self.cond:
+            self.active -= 1
+            self._grant_next()
+
+    @contextmanager
+    def slot(self, client_key: str):
+        """Hold one LLM slot for the duration of the block"""
+        self.acquire(client_key)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def get_stats(self) -> Dict:
+        with self.cond:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "active": self.active,
+                "waiting_clients": len(self.waiting),
+                "waiting_requests": sum(len(t) for t in self.waiting.values()),
+                "granted": self.granted,
+                "timeouts": self.timeouts,
+            }
+
+
+rate_limiter = RateLimiter(RATE_LIMITS, RATE_LIMIT_REDIS_URL, RATE_LIMIT_REDIS_RETRY_AFTER)
+llm_scheduler = FairLLMScheduler(LLM_MAX_CONCURRENCY, LLM_QUEUE_TIMEOUT)
+
+
+def get_client_ip() -> str:
+    """Client IP as seen by the nearest trusted proxy (see TRUSTED_PROXY_COUNT)"""
+    return request.remote_addr or "unknown"
+
+
+def rate_limited_response(retry_after: float):
+    """Cheap 429 response with a Retry-After header"""
+    seconds = max(1, math.ceil(retry_after))
+    response = jsonify({"error": "Too many requests, please slow down", "retry_after": seconds})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(seconds)
+    return response
+
+
+def enforce_rate_limits(endpoint: str, conversation_id: str = None):
+    """Return a 429 response if the caller is over its limits, otherwise None"""
+    if not RATE_LIMIT_ENABLED:
+        return None
+    cost = ENDPOINT_COSTS.get(endpoint, 1.0)
+    allowed, retry_after = rate_limiter.check("ip", get_client_ip(), cost)
+    if not allowed:
+        return rate_limited_response(retry_after)
+    if conversation_id:
+        allowed, retry_after = rate_limiter.check("conversation", conversation_id, cost)
+        if not allowed:
+            return rate_limited_response(retry_after)
+    return None
+
+
+# ==========================================================
+# 🔬 On-demand profiling (admin only)
+# ==========================================================
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# Hooks are only registered when enabled, so production pays nothing otherwise
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_SAMPLE_RATE = _env_float("PROFILE_SAMPLE_RATE", 0.0)
+PROFILE_KEEP = int(_env_float("PROFILE_KEEP", 20))
+PROFILE_MAX_SECONDS = _env_float("PROFILE_MAX_SECONDS", 300)
+
+
+def is_admin_request() -> bool:
+    """True when the request carries the configured admin token"""
+    if not ADMIN_TOKEN:
+        return False
+    # compare_digest rejects non-ASCII str, so compare bytes to keep odd headers a plain 403
+    return hmac.compare_digest(request.headers.get("X-Admin-Token", "").encode("utf-8"), ADMIN_TOKEN.encode("utf-8"))
+
+
+def admin_forbidden():
+    return jsonify({"error": "Forbidden"}), 403
+
+
+class RequestProfileStore:
+    """Keep the most recent per-request cProfile captures"""
+
+    def __init__(self, keep: int):
+        self.profiles = OrderedDict()  # profile_id -> capture
+        self.keep = keep
+        self.lock = Lock()
+
+    def add(self, path: str, duration: float, profiler: cProfile.Profile) -> str:
+        profile_id = uuid.uuid4().hex[:12]
+        profiler.create_stats()
         with self.lock:
-            if conversation_id in self.conversations:
-                self.conversations[conversation_id]['user_name'] = name
-                self.conversations[conversation_id]['last_activity'] = time.time()
-    
-    def get_user_name(self, conversation_id: str) -> str:
-        """Get user name for a conversation"""
+            self.profiles[profile_id] = {
+                'path': path,
+                'duration_ms': round(duration * 1000, 2),
+                'captured_at': time.time(),
+                'stats': profiler.stats
+            }
+            while len(self.profiles) > self.keep:
+                self.profiles.popitem(last=False)
+        return profile_id
+
+    def list(self) -> List[Dict]:
         with self.lock:
-            conv = self.conversations.get(conversation_id)
-            return conv['user_name'] if conv else None
-    
-    def add_message(self, conversation_id: str, role: str, content: str):
-        """🆕 Added: Add a message to conversation history"""
+            return [
+                {'id': pid, 'path': p['path'], 'duration_ms': p['duration_ms'], 'captured_at': p['captured_at']}
+                for pid, p in self.profiles.items()
+            ]
+
+    def get(self, profile_id: str) -> Optional[Dict]:
         with self.lock:
-            if conversation_id in self.conversations:
-                self.conversations[conversation_id]['messages'].append({
-                    'role': role,
-                    'content': content,
-                    'timestamp': time.time()
-                })
-                # Keep only last 10 messages to avoid token limits
-                if len(self.conversations[conversation_id]['messages']) > 10:
-                    self.conversations[conversation_id]['messages'] = \
-                        self.conversations[conversation_id]['messages'][-10:]
-                self.conversations[conversation_id]['last_activity'] = time.time()
-    
-    def get_conversation_history(self, conversation_id: str, max_messages: int = 10) -> List[Dict]:
-        """🆕 Added: Get conversation history"""
+            return self.profiles.get(profile_id)
+
+
+class SamplingProfiler:
+    """Time-boxed whole-process stack sampler producing collapsed-stack output"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+        self.interval = None
+
+    def start(self, duration: float, interval: float) -> bool:
         with self.lock:
-            conv = self.conversations.get(conversation_id)
-            if conv and 'messages' in conv:
-                return conv['messages'][-max_messages:]
-            return []
-    
-    def get_full_conversation(self, conversation_id: str) -> Dict:
-        """🆕 NEW: Get full conversation data including all messages"""
+            if self.thread and self.thread.is_alive():
+                return False
+            self.stacks = Counter()
+            self.samples = 0
+            self.started_at = time.time()
+            self.stopped_at = None
+            self.interval = interval
+            self.stop_event.clear()
+            self.thread = threading.Thread(
+                target=self._run, args=(min(duration, PROFILE_MAX_SECONDS), interval),
+                name="wacs-sampling-profiler", daemon=True
+            )
+            self.thread.start()
+            return True
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+
+    def _run(self, duration: float, interval: float):
+        own_ident = threading.get_ident()
+        deadline = time.monotonic() + duration
+        while not self.stop_event.is_set() and time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                with self.lock:
+                    self.stacks[";".join(reversed(stack))] += 1
+            with self.lock:
+                self.samples += 1
+            self.stop_event.wait(interval)
         with self.lock:
-            conv = self.conversations.get(conversation_id)
-            if conv:
-                return {
-                    'user_name': conv.get('user_name'),
-                    'messages': conv.get('messages', []),
-                    'created_at': conv.get('created_at'),
-                    'last_activity': conv.get('last_activity')
-                }
-            return None
-    
-    def cleanup_old_conversations(self, max_age_hours: int = 24):
-        """Clean up conversations older than max_age_hours"""
+            self.stopped_at = time.time()
+
+    def status(self) -> Dict:
         with self.lock:
-            current_time = time.time()
-            to_remove = []
-            for conv_id, conv_data in self.conversations.items():
-                if current_time - conv_data['last_activity'] > max_age_hours * 3600:
-                    to_remove.append(conv_id)
-            
-            for conv_id in to_remove:
-                del self.conversations[conv_id]
+            return {
+                'running': bool(self.thread and self.thread.is_alive()),
+                'samples': self.samples,
+                'interval': self.interval,
+                'started_at': self.started_at,
+                'stopped_at': self.stopped_at,
+                'distinct_stacks': len(self.stacks)
+            }
+
+    def collapsed(self) -> str:
+        """Brendan Gregg collapsed-stack format, ready for flamegraph tools"""
+        with self.lock:
+            return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
 
-# 🔧 FIX #1: Initialize the ConversationManager
-conversation_manager = ConversationManager()
 
-# Initialize SentenceTransformer
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+request_profiles = RequestProfileStore(PROFILE_KEEP)
+sampling_profiler = SamplingProfiler()
+
+
+def _start_request_profile():
+    """Profile this request if an admin asked for it or it was sampled"""
+    forced = request.headers.get("X-Profile") == "1" and is_admin_request()
+    if forced or (PROFILE_SAMPLE_RATE > 0 and uuid.uuid4().int % 10000 < PROFILE_SAMPLE_RATE * 10000):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return  # Another profiler is already active on this interpreter
+        g.profiler = profiler
+        g.profile_started = time.perf_counter()
+
+
+def _finish_request_profile(response):
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        duration = time.perf_counter() - g.pop("profile_started")
+        profile_id = request_profiles.add(request.path, duration, profiler)
+        response.headers["X-Profile-Id"] = profile_id
+    return response
+
+
+if PROFILING_ENABLED:
+    app.before_request(_start_request_profile)
+    app.after_request(_finish_request_profile)
+    print(f"🔬 Request profiling enabled (sample rate {PROFILE_SAMPLE_RATE})")
+
+# Initialize embeddings: use the shared sidecar when EMBEDDING_SOCKET is set, else load MiniLM in-process
+embedding_model = EmbeddingClient(
+    os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2"),
+    socket_path=os.getenv("EMBEDDING_SOCKET")
+)
+if embedding_model.socket_path and not embedding_model.wait_for_sidecar(_env_float("EMBEDDING_SOCKET_WAIT", 10)):
+    print(f"⚠️ Embedding sidecar not reachable at {embedding_model.socket_path}, will embed in-process")
 
 # WACS Knowledge Base - Updated with WACS FAQ content
 wacs_faqs = [
     {
         "question": 'How can I effect stoppage on my loan deductions?',
         "answer": 'For deductions under WACS, the description on your payslip begins with "WACS" followed by the name of the financial institution. Kindly send your letter of non-indebtedness to support@wacs.com.ng. For Cooperative deductions labeled as "COOP" and "CTLS", send your letter to your desk officer. For deductions not on your payslip, contact support@remita.net. For Police, Military, and Paramilitary officers, obtain a letter from the financial institution and forward it to your desk officer.',
-        "category": 'loan_deductions'
+        "category": 'loan_deductions',
+        "paraphrases": ['stop my loan deduction', 'how do I stop deductions from my salary', 'stop WACS deduction on payslip', 'cancel loan deduction', 'end deduction after paying off loan']
     },
     {
         "question": 'What is WACS?',
         "answer": 'WACS is an acronym for Workers Aggregated Credit Scheme. It is a platform designed to solve credit access difficulties encountered by civil servants, providing end-to-end solutions for loan management.',
-        "category": 'general'
+        "category": 'general',
+        "paraphrases": ['meaning of WACS', 'what does WACS stand for', 'tell me about WACS', 'Workers Aggregated Credit Scheme']
     },
     {
     "question": "How can I get a Letter of Non-Indebtedness?",
@@ -137,163 +532,195 @@ For deductions under WACS, the description on your payslip begins with "WACS" fo
 Kindly send your letter of non-indebtedness to support@wacs.com.ng.
 For Cooperative deductions, these appear on your payslip and are labeled as "COOP." and "CTLS". 
 Kindly send your letter of non-indebtedness to your desk officer to effect stoppage.""",
-    "category": "loan_management"
+    "category": "loan_management",
+    "paraphrases": ['letter of non indebtedness', 'where do I get non-indebtedness letter', 'clearance letter from lender', 'proof that I have paid my loan']
 }
 ,
     {
         "question": 'Does IPPIS give out loans?',
         "answer": 'No, IPPIS does not issue loans. However, you can visit the IPPIS-OAGF application to request a loan from any financial institution with the loan product that suits your needs.',
-        "category": 'general'
+        "category": 'general',
+        "paraphrases": ['does IPPIS lend money', 'can IPPIS give me loan', 'is IPPIS a lender', 'IPPIS loan']
     },
     {
         "question": 'Where can I see my loan deduction?',
         "answer": 'You can view your loan deductions on your payslip, except for loans processed through Remita. For Remita loan details, please contact support@remita.net',
-        "category": 'loan_deductions'
+        "category": 'loan_deductions',
+        "paraphrases": ['where is my loan deduction shown', 'check deduction on payslip', "I can't see my loan deduction", 'view deductions']
     },
     {
         "question": 'How can I get my refund?',
         "answer": 'For refund-related issues, please contact your financial institution directly.',
-        "category": 'payment'
+        "category": 'payment',
+        "paraphrases": ['refund my money', 'I want a refund', 'overdeduction refund', 'money back from lender']
     },
     {
         "question": 'Where can I get my payslip?',
         "answer": 'You can obtain your payslip from your desk officer or by logging into the IPPIS-OAGF application using your IPPIS number.',
-        "category": 'general'
+        "category": 'general',
+        "paraphrases": ['download payslip', 'how to get payslip', 'print my payslip', 'access my pay slip']
     },
     {
         "question": 'My net pay is different from what I received as salary. What should I do?',
         "answer": 'Review your payslip to verify all statutory and non-statutory deductions. If the net pay on your payslip differs from what you received, direct your complaint to your financial institution or Remita via support@remita.net',
-        "category": 'payment'
+        "category": 'payment',
+        "paraphrases": ['net pay not matching salary received', 'salary received is less than net pay', 'amount paid different from payslip', 'my salary is short compared to payslip']
     },
     {
         "question": 'How can I get my loan statement?',
         "answer": 'Please contact your financial institution to request your loan statement of account.',
-        "category": 'loan_management'
+        "category": 'loan_management',
+        "paraphrases": ['loan statement of account', 'get statement for my loan', 'loan history statement', 'request account statement from lender']
     },
     {
         "question": 'I did not request for a loan, but I was credited by WACS. How do I refund the money?',
         "answer": 'Kindly provide the transaction receipt, name, and IPPIS number to support@wacs.com.ng and a response will be provided within 48 hours.',
-        "category": 'loan_management'
+        "category": 'loan_management',
+        "paraphrases": ['money credited without applying', 'received loan I did not apply for', 'return unsolicited loan', 'WACS credited my account by mistake']
     },
     {
         "question": 'I have liquidated my loan, but deductions are still ongoing. What should I do?',
         "answer": 'For WACS deductions (beginning with "WACS" on your payslip), send your letter of non-indebtedness to support@wacs.com.ng. For Cooperative deductions (labeled "COOP" and "CTLS"), send to your desk officer. For deductions not on your payslip, contact support@remita.net. For Police, Military, and Paramilitary officers, obtain a letter from the financial institution and forward to your desk officer.',
-        "category": 'loan_deductions'
+        "category": 'loan_deductions',
+        "paraphrases": ['finished paying loan but still deducted', 'loan fully paid deduction continues', 'deduction after liquidation', 'overdeduction after completing loan']
     },
     {
         "question": 'I was short-paid. What should I do?',
         "answer": 'Kindly review your payslip to see all deductions, as all deductions from your salary are reflected there. You can also call the IPPIS support line at 07002754774 and follow the prompts for assistance.',
-        "category": 'payment'
+        "category": 'payment',
+        "paraphrases": ['my salary is short', 'salary shortfall', 'I was underpaid', 'short payment of salary', 'less salary this month']
     },
     {
         "question": 'I applied for a loan through the IPPIS-OAGF Mobile application yesterday but I have not received it. What should I do?',
         "answer": 'Loan disbursements are typically processed within 48 hours. If you have not received your loan after this period, kindly send a mail to support@wacs.com.ng with your complaint and feedback will be provided.',
-        "category": 'loan_application'
+        "category": 'loan_application',
+        "paraphrases": ['loan not received from IPPIS app', 'applied on IPPIS-OAGF app no disbursement', 'mobile app loan not credited', 'waiting for loan from app']
     },
     {
         "question": 'I applied for a loan through a registered lender on the WACS platform but I have not received it. What should I do?',
         "answer": 'Loan disbursements are typically processed within 48 hours. If you have not received your loan after this period, kindly send a mail to support@wacs.com.ng with your complaint and feedback will be provided.',
-        "category": 'loan_application'
+        "category": 'loan_application',
+        "paraphrases": ['loan from lender not received', 'lender has not disbursed my loan', 'applied through WACS lender no money', 'loan approved but not paid']
     },
     {
         "question": 'How can I check my loan balance?',
         "answer": 'Kindly log into the IPPIS-OAGF app to view your loan balance on the dashboard or alternatively contact the lender for the loan balance.',
-        "category": 'loan_management'
+        "category": 'loan_management',
+        "paraphrases": ['loan balance', 'how much do I still owe', 'outstanding loan amount', 'remaining balance on my loan']
     },
     {
         "question": 'Who can apply for a loan through IPPIS-OAGF Application?',
         "answer": 'Only Federal Government employees who possess a valid IPPIS number and meet the eligibility criteria are eligible to apply through the platform.',
-        "category": 'eligibility'
+        "category": 'eligibility',
+        "paraphrases": ['who is eligible for loan', 'eligibility for IPPIS loan', 'can I apply for loan', 'requirements to get a loan']
     },
     {
         "question": 'How much can I borrow through the IPPIS-OAGF Application?',
         "answer": 'The maximum loan amount is determined by the specific loan product and the civil servant\'s eligibility in accordance with civil service rules.',
-        "category": 'eligibility'
+        "category": 'eligibility',
+        "paraphrases": ['maximum loan amount', 'how much loan can I get', 'loan limit', 'how much can I take']
     },
     {
         "question": 'What is the interest rate for loans offered through IPPIS-OAGF?',
         "answer": 'Interest rates vary based on the loan product offered by each financial institution and are clearly displayed by the respective lenders on the platform.',
-        "category": 'loan_terms'
+        "category": 'loan_terms',
+        "paraphrases": ['interest rate', 'what is the interest on the loan', 'loan charges', 'cost of borrowing']
     },
     {
         "question": 'Can I change the repayment schedule for my loan after approval?',
         "answer": 'No. Once a loan is approved, the repayment schedule cannot be modified.',
-        "category": 'loan_terms'
+        "category": 'loan_terms',
+        "paraphrases": ['change repayment plan', 'reschedule my loan repayment', 'modify loan tenure', 'extend repayment period']
     },
     {
         "question": 'Can I apply for a loan through the IPPIS-OAGF Application if I am not a government worker?',
         "answer": 'No. Only Federal Government employees with a valid IPPIS Number are eligible to register on the WACS platform.',
-        "category": 'eligibility'
+        "category": 'eligibility',
+        "paraphrases": ['non government worker loan', 'private sector worker loan', 'can state workers apply', 'loan for non civil servant']
     },
     {
         "question": 'How do I repay my loan?',
         "answer": 'Loan repayments are automatically deducted from your salary.',
-        "category": 'loan_repayment'
+        "category": 'loan_repayment',
+        "paraphrases": ['loan repayment method', 'how to pay back loan', 'pay loan', 'repayment through salary']
     },
     {
         "question": 'When do I start repaying my loan?',
         "answer": 'A moratorium period is determined by the financial institution based on the specific loan product you applied for. Please review your loan details carefully.',
-        "category": 'loan_repayment'
+        "category": 'loan_repayment',
+        "paraphrases": ['when does repayment start', 'moratorium period', 'first deduction date', 'grace period before repayment']
     },
     {
         "question": 'Which account will my loan be paid into?',
         "answer": 'All loan disbursements are sent directly to your salary account.',
-        "category": 'loan_disbursement'
+        "category": 'loan_disbursement',
+        "paraphrases": ['which account gets my loan', 'where will loan be paid', 'loan disbursement account', 'salary account credit']
     },
     {
         "question": 'How can I contact IPPIS Support?',
         "answer": 'You can contact IPPIS Support via email at support@ippis.gov.ng or call 0700 275 4774 and follow the prompt.',
-        "category": 'support'
+        "category": 'support',
+        "paraphrases": ['IPPIS support contact', 'IPPIS phone number', 'IPPIS email', 'reach IPPIS helpdesk']
     },
     {
         "question": 'How can I differentiate between WACS, Remita, and Cooperative deductions?',
         "answer": 'All WACS deductions begin with the word "WACS" followed by the name of the Financial Institution and appear on your payslip. Cooperative deductions are labeled as "COOP" and also appear on your payslip. However, Remita deductions do not appear on civil servants payslips.',
-        "category": 'loan_deductions'
+        "category": 'loan_deductions',
+        "paraphrases": ['difference between WACS, Remita and COOP deductions', 'COOP CTLS deduction', 'identify deduction type on payslip', 'what is CTLS on my payslip']
     },
     {
         "question": 'I didn\'t request a loan but was erroneously deducted?',
         "answer": 'Kindly contact IPPIS Support via email at support@ippis.gov.ng or call 0700 275 4774 for assistance.',
-        "category": 'loan_deductions'
+        "category": 'loan_deductions',
+        "paraphrases": ['deducted for loan I never took', 'wrong deduction', 'unauthorized deduction', 'erroneous loan deduction']
     },
     {
         "question": 'How can I get Lenders Contact Information?',
         "answer": 'Kindly contact IPPIS Support via email at support@ippis.gov.ng or call 0700 275 4774 for assistance.',
-        "category": 'support'
+        "category": 'support',
+        "paraphrases": ['lender contact details', 'phone number of my lender', 'how to reach my lender', 'lenders contact']
     },
     {
         "question": 'How can I request for a loan?',
         "answer": 'You can request for a loan through the IPPIS-OAGF application portal. Note that only MDA Federal Civil Servants can request for a loan through this application.',
-        "category": 'loan_application'
+        "category": 'loan_application',
+        "paraphrases": ['apply for loan', 'how do I get a loan', 'request loan', 'loan application process']
     },
     {
         "question": 'How can I update my phone number?',
         "answer": 'You can update your phone number through your desk officer in your ministry.',
-        "category": 'account_management'
+        "category": 'account_management',
+        "paraphrases": ['change phone number', 'update mobile number', 'new phone number on IPPIS', 'wrong phone number']
     },
     {
         "question": 'I have not received my salary for this Month?',
         "answer": 'Kindly send your Name, IPPIS number, Ministry and bank statement to support@ippis.gov.ng for assistance.',
-        "category": 'payment'
+        "category": 'payment',
+        "paraphrases": ['salary not paid', 'I have not been paid this month', 'missing salary', 'salary not received']
     },
     {
         "question": 'I would like to update my maiden name. I just got married.',
         "answer": 'Kindly notify your desk officer to write a letter to the head of service for change of name. Additionally, include a copy of your marriage certificate, newspaper publication and all other necessary documents.',
-        "category": 'account_management'
+        "category": 'account_management',
+        "paraphrases": ['change of name after marriage', 'update surname', 'maiden name change', 'new married name']
     },
     {
         "question": 'How can I change my Account details on my Payslip?',
         "answer": 'Kindly reach out to your desk officer or payroller to update your account details.',
-        "category": 'account_management'
+        "category": 'account_management',
+        "paraphrases": ['change bank account', 'update salary account', 'change account number on payslip', 'new bank details']
     },
     {
         "question": 'How can I change my date of birth?',
         "answer": 'Kindly submit a written request to the Head of Service through your desk officer to update your date of birth.',
-        "category": 'account_management'
+        "category": 'account_management',
+        "paraphrases": ['correct date of birth', 'wrong date of birth', 'update DOB', 'date of birth change']
     },
     {
         "question": 'I experienced an increase in my loan deduction?',
         "answer": 'Review your payslip to verify all deduction amounts. However, you can direct your complaint to your financial institution.',
-        "category": 'loan_deductions'
+        "category": 'loan_deductions',
+        "paraphrases": ['loan deduction increased', 'deduction went up', 'higher deduction this month', 'deduction amount changed']
     }
     
 ]
@@ -359,85 +786,225 @@ class HyperlinkProcessor:
         """Process FAQ answer to include hyperlinks"""
         return HyperlinkProcessor.convert_to_hyperlinks(answer)
 
+# Retrieval tuning: how many FAQs go into the prompt and how close runners-up must score to the best match
+RAG_MAX_PROMPT_FAQS = int(_env_float("RAG_MAX_PROMPT_FAQS", 3))
+RAG_SCORE_MARGIN = _env_float("RAG_SCORE_MARGIN", 0.08)
+# Retrieval results cached by surface and canonical query
+RETRIEVAL_CACHE_SIZE = int(_env_float("RETRIEVAL_CACHE_SIZE", 2048))
+
+# Model tiers: simple, well-covered questions go to the fast tier
+LLM_FAST_MODEL = os.getenv("LLM_FAST_MODEL", "claude-haiku-4-5-20251001")
+LLM_STRONG_MODEL = os.getenv("LLM_STRONG_MODEL", "claude-sonnet-4-5-20250929")
+ROUTE_CONFIDENT_SCORE = _env_float("ROUTE_CONFIDENT_SCORE", 0.6)
+# Earlier user questions in the conversation (canned greetings excluded) after which the strong tier is used;
+# counted by ConversationManager, so values above the MAX_MESSAGES history window still apply
+ROUTE_LONG_CONVERSATION = int(_env_float("ROUTE_LONG_CONVERSATION", 4))
+
+
+class ModelRouter:
+    """Pick model tier and max_tokens from retrieval confidence, intent and conversation length"""
+    
+    ROUTES = {
+        "smalltalk": {"model": LLM_FAST_MODEL, "max_tokens": 80},
+        "fast": {"model": LLM_FAST_MODEL, "max_tokens": 200},
+        "standard": {"model": LLM_STRONG_MODEL, "max_tokens": 300},
+        "complex": {"model": LLM_STRONG_MODEL, "max_tokens": 450},
+    }
+    
+    SMALLTALK_PATTERN = re.compile(
+        r"^\W*(thanks?|thank (you|u)|thx|ok(ay)?|alright|great|cool|noted|bye|goodbye|good night)"
+        r"( (so much|a lot|very much|again))?\W*$"
+    )
+    COMPLEX_HINTS = (
+        'still', 'again', 'already', 'not working', 'didn\'t work', 'tried', 'nobody', 'no response',
+        'frustrated', 'angry', 'why', 'explain', 'difference', 'both', 'and also'
+    )
+    
+    def __init__(self):
+        self.lock = Lock()
+        self.stats = {
+            name: {"count": 0, "errors": 0, "input_tokens": 0, "output_tokens": 0, "latencies": deque(maxlen=500)}
+            for name in self.ROUTES
+        }
+    
+    def is_smalltalk(self, user_query: str) -> bool:
+        """Acknowledgements like "thanks" or "ok" that need no FAQ context"""
+        return bool(self.SMALLTALK_PATTERN.match(user_query.lower().strip()))
+    
+    def choose(self, user_query: str, relevant_faqs: List[Dict], prior_questions: int = 0) -> Dict:
+        """Return the route for this turn: name, model, max_tokens and the reason it was picked"""
+        query = user_query.lower().strip()
+        top_score = relevant_faqs[0]['score'] if relevant_faqs else 0.0
+        
+        if self.is_smalltalk(query):
+            name, reason = "smalltalk", "acknowledgement"
+        elif len(query) > 300 or query.count('?') > 1 or any(hint in query for hint in self.COMPLEX_HINTS):
+            name, reason = "complex", "complex_intent"
+        elif prior_questions >= ROUTE_LONG_CONVERSATION:
+            name, reason = "standard", "long_conversation"
+        elif top_score >= ROUTE_CONFIDENT_SCORE and len(relevant_faqs) == 1:
+            name, reason = "fast", "confident_single_faq"
+        else:
+            name, reason = "standard", "low_confidence"
+        
+        return {"name": name, "reason": reason, "top_score": round(top_score, 4), **self.ROUTES[name]}
+    
+    def record(self, route_name: str, latency: float, usage=None, error: bool = False):
+        """Record latency and token usage for a call, including failed or timed-out ones"""
+        with self.lock:
+            stats = self.stats[route_name]
+            stats["count"] += 1
+            stats["latencies"].append(latency)
+            if error:
+                stats["errors"] += 1
+            if usage is not None:
+                stats["input_tokens"] += getattr(usage, "input_tokens", 0) or 0
+                stats["output_tokens"] += getattr(usage, "output_tokens", 0) or 0
+    
+    def get_stats(self) -> Dict:
+        with self.lock:
+            result = {}
+            for name, stats in self.stats.items():
+                latencies = sorted(stats["latencies"])
+                count = stats["count"]
+                successes = count - stats["errors"]
+                result[name] = {
+                    "model": self.ROUTES[name]["model"],
+                    "max_tokens": self.ROUTES[name]["max_tokens"],
+                    "count": count,
+                    "errors": stats["errors"],
+                    "latency_p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+                    "latency_p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 1) if latencies else None,
+                    "avg_input_tokens": round(stats["input_tokens"] / successes, 1) if successes else None,
+                    "avg_output_tokens": round(stats["output_tokens"] / successes, 1) if successes else None,
+                }
+            return result
+
+
+model_router = ModelRouter()
+
+
 class WACSRAGSystem:
     def __init__(self):
-        self.collection_name = "wacs_faqs"
-        # Initialize ChromaDB client as instance attribute
-        self.chroma_client = chromadb.Client()
         self.hyperlink_processor = HyperlinkProcessor()
+        self.query_normalizer = QueryNormalizer(wacs_faqs)
+        self.retrieval_cache = OrderedDict()  # (surface, canonical, n_results) -> FAQs, in LRU order
+        self.cache_lock = Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
         self.setup_vector_database()
     
     def setup_vector_database(self):
-        """Initialize ChromaDB collection with WACS FAQs"""
+        """Build the multi-vector FAQ index (question, answer and paraphrases per FAQ)"""
         try:
-            # Delete existing collection if it exists
-            try:
-                self.chroma_client.delete_collection(name=self.collection_name)
-            except:
-                pass
+            # Each FAQ owns a contiguous block of rows so scores can be max-reduced per FAQ
+            texts = []
+            offsets = []
+            for faq in wacs_faqs:
+                offsets.append(len(texts))
+                texts.extend([faq['question'], faq['answer']] + faq.get('paraphrases', []))
             
-            # Create new collection
-            self.collection = self.chroma_client.create_collection(
-                name=self.collection_name,
-                metadata={"hnsw:space": "cosine"}
-            )
+            self.faq_vectors = embedding_model.encode(
+                texts,
+                batch_size=64,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            ).astype(np.float32)
+            self.faq_offsets = np.asarray(offsets, dtype=np.int64)
             
-            # Prepare documents for embedding
-            documents = []
-            metadatas = []
-            ids = []
-            
-            for i, faq in enumerate(wacs_faqs):
-                # Combine question and answer for better context
-                doc_text = f"Question: {faq['question']}\nAnswer: {faq['answer']}"
-                documents.append(doc_text)
-                metadatas.append({
-                    "category": faq['category'],
-                    "question": faq['question'],
-                    "answer": faq['answer']
-                })
-                ids.append(str(uuid.uuid4()))
-            
-            # Add documents to collection
-            self.collection.add(
-                documents=documents,
-                metadatas=metadatas,
-                ids=ids
-            )
-            
-            print(f"✅ Vector database initialized with {len(wacs_faqs)} FAQs")
+            print(f"✅ Vector index initialized with {len(wacs_faqs)} FAQs ({len(texts)} vectors)")
             
         except Exception as e:
             print(f"❌ Error setting up vector database: {e}")
+            self.faq_vectors = np.zeros((0, 0), dtype=np.float32)
+            self.faq_offsets = np.zeros(0, dtype=np.int64)
+    
+    def score_faqs(self, *queries: str) -> np.ndarray:
+        """Cosine max-sim of the queries against every FAQ's vectors, one score per FAQ"""
+        query_vectors = embedding_model.encode(
+            list(dict.fromkeys(queries)),
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        ).astype(np.float32)
+        sims = (self.faq_vectors @ query_vectors.T).max(axis=1)
+        return np.maximum.reduceat(sims, self.faq_offsets)
     
     def retrieve_relevant_faqs(self, query: str, n_results: int = 3) -> List[Dict]:
         """Retrieve most relevant FAQs based on user query"""
         try:
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=n_results
-            )
+            if len(self.faq_offsets) == 0:
+                return []
+            
+            # Spell correction can misfire on real words outside the FAQ vocabulary
+            # ("excess" -> "access"), so the surface form is scored alongside the canonical one.
+            # Both are in the cache key, so casing, spacing and punctuation variants share an entry
+            surface_query = self.query_normalizer.surface(query) or query
+            canonical_query = self.query_normalizer.normalize(query) or surface_query
+            cache_key = (surface_query, canonical_query, n_results)
+            with self.cache_lock:
+                cached = self.retrieval_cache.get(cache_key)
+                if cached is not None:
+                    self.retrieval_cache.move_to_end(cache_key)
+                    self.cache_hits += 1
+                    return [dict(faq) for faq in cached]
+                self.cache_misses += 1
+            
+            scores = self.score_faqs(surface_query, canonical_query)
+            n_results = min(n_results, len(scores))
+            top = np.argpartition(-scores, n_results - 1)[:n_results]
+            top = top[np.argsort(-scores[top])]
             
             relevant_faqs = []
-            if results['metadatas'] and len(results['metadatas'][0]) > 0:
-                for metadata in results['metadatas'][0]:
-                    relevant_faqs.append({
-                        "question": metadata['question'],
-                        "answer": metadata['answer'],
-                        "category": metadata['category']
-                    })
+            for idx in top:
+                faq = wacs_faqs[idx]
+                relevant_faqs.append({
+                    "question": faq['question'],
+                    "answer": faq['answer'],
+                    "category": faq['category'],
+                    "score": round(float(scores[idx]), 4)
+                })
             
-            return relevant_faqs
+            with self.cache_lock:
+                self.retrieval_cache[cache_key] = relevant_faqs
+                while len(self.retrieval_cache) > RETRIEVAL_CACHE_SIZE:
+                    self.retrieval_cache.popitem(last=False)
+            
+            return [dict(faq) for faq in relevant_faqs]
             
         except Exception as e:
             print(f"❌ Error retrieving FAQs: {e}")
             return []
     
-    def generate_rag_response(self, user_query: str, user_name: str = None, conversation_history: List[Dict] = None) -> Dict:
+    def get_cache_stats(self) -> Dict:
+        with self.cache_lock:
+            lookups = self.cache_hits + self.cache_misses
+            return {
+                "size": len(self.retrieval_cache),
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "hit_rate": round(self.cache_hits / lookups, 4) if lookups else None
+            }
+    
+    @staticmethod
+    def select_prompt_faqs(relevant_faqs: List[Dict]) -> List[Dict]:
+        """Keep the best FAQ plus only runners-up that score close to it"""
+        if not relevant_faqs:
+            return []
+        best = relevant_faqs[0]['score']
+        selected = [faq for faq in relevant_faqs if best - faq['score'] <= RAG_SCORE_MARGIN]
+        return selected[:RAG_MAX_PROMPT_FAQS]
+    
+    def generate_rag_response(self, user_query: str, user_name: str = None, conversation_history: List[Dict] = None,
+                              client_key: str = "anonymous", prior_questions: int = 0) -> Dict:
         """Generate response using RAG with conversation context"""
         try:
-            # Step 1: Retrieve relevant FAQs
-            relevant_faqs = self.retrieve_relevant_faqs(user_query, n_results=3)
+            # Step 1: Retrieve relevant FAQs, sending only the confident matches to Claude
+            # ("thanks" and "ok" get no FAQ context, so the reply stays a short acknowledgement)
+            relevant_faqs = []
+            if not model_router.is_smalltalk(user_query):
+                relevant_faqs = self.select_prompt_faqs(
+                    self.retrieve_relevant_faqs(user_query, n_results=RAG_MAX_PROMPT_FAQS)
+                )
             
             # Step 2: Build context from relevant FAQs
             context = ""
@@ -518,13 +1085,29 @@ LOAN DEDUCTION TYPES:
             
             # Step 6: Generate response using Claude
             # ✅ UPDATED: Changed to Anthropic API format
-            response = client.messages.create(
-                model="claude-sonnet-4-5-20250929",  # ✅ Using Claude Sonnet 4.5
-                max_tokens=300,  # ✅ Limit for concise responses
-                temperature=0.7,  # ✅ Natural, conversational tone
-                system=system_prompt,  # ✅ System prompt separate in Anthropic
-                messages=messages
-            )
+            # Step 6b: Pick model tier and response budget for this turn
+            route = model_router.choose(user_query, relevant_faqs, prior_questions)
+            
+            # 🚦 Wait for a fair share of the shared LLM concurrency
+            with llm_scheduler.slot(client_key):
+                started = time.perf_counter()
+                response = None
+                try:
+                    response = client.messages.create(
+                        model=route["model"],
+                        max_tokens=route["max_tokens"],
+                        temperature=0.7,  # ✅ Natural, conversational tone
+                        system=system_prompt,  # ✅ System prompt separate in Anthropic
+                        messages=messages
+                    )
+                finally:
+                    # Failed and timed-out calls count too, so p95 reflects what users waited
+                    model_router.record(
+                        route["name"],
+                        time.perf_counter() - started,
+                        getattr(response, "usage", None),
+                        error=response is None
+                    )
             
             raw_response = response.content[0].text  # ✅ Extract text from Claude response
             
@@ -536,9 +1119,12 @@ LOAN DEDUCTION TYPES:
                 "response": raw_response,
                 "response_with_links": processed_response,
                 "relevant_faqs": relevant_faqs,
-                "context_used": bool(context)
+                "context_used": bool(context),
+                "route": route
             }
             
+        except LLMBusyError:
+            raise  # Let the endpoint answer with 429 + Retry-After
         except Exception as e:
             print(f"❌ Error generating RAG response: {e}")
             error_message = "Oops! I'm having a moment here. Can you try again, or reach out to support@wacs.com.ng?"
@@ -546,14 +1132,25 @@ LOAN DEDUCTION TYPES:
                 "response": error_message,
                 "response_with_links": self.hyperlink_processor.convert_to_hyperlinks(error_message),
                 "relevant_faqs": [],
-                "context_used": False
+                "context_used": False,
+                "route": None
             }
 
 # Initialize RAG system
 rag_system = WACSRAGSystem()
 
-# Initialize conversation manager
-conversation_manager = ConversationManager()
+# Initialize conversation manager; idle histories are compressed with a dictionary of typical replies
+CONVERSATION_COMPRESS_AFTER = _env_float("CONVERSATION_COMPRESS_AFTER", 600)
+CONVERSATION_MAINTENANCE_INTERVAL = _env_float("CONVERSATION_MAINTENANCE_INTERVAL", 60)
+conversation_manager = ConversationManager(
+    compress_after=CONVERSATION_COMPRESS_AFTER,
+    codec=HistoryCodec(
+        [faq['question'] for faq in wacs_faqs]
+        + [faq['answer'] for faq in wacs_faqs]
+        + ["May I know your name?", "Hello! May I know your name?", "Nice to meet you 😊 How can I help you today?"]
+    )
+)
+conversation_manager.start_maintenance(interval=CONVERSATION_MAINTENANCE_INTERVAL)
 
 def extract_name_from_message(message: str) -> str:
     """Extract name from user message"""
@@ -618,6 +1215,10 @@ def chat():
     if not user_input:
         return jsonify({"error": "No message received"}), 400
     
+    limited = enforce_rate_limits("chat", conversation_id)
+    if limited:
+        return limited
+    
     try:
         # Get or create conversation
         conversation = conversation_manager.get_or_create_conversation(conversation_id)
@@ -671,6 +1272,9 @@ def chat():
                         "conversation_id": conversation_id
                     })
         
+        # Questions asked before this one, over the whole conversation rather than the capped history
+        prior_questions = conversation_manager.get_question_count(conversation_id)
+        
         # 🆕 Store user message in history
         conversation_manager.add_message(conversation_id, "user", user_input)
         
@@ -681,21 +1285,34 @@ def chat():
         response_data = rag_system.generate_rag_response(
             user_input, 
             user_name,
-            conversation_history  # 🆕 Pass conversation history
+            conversation_history,  # 🆕 Pass conversation history
+            client_key=get_client_ip(),
+            prior_questions=prior_questions
         )
         
         # 🆕 Store bot response in history
-        conversation_manager.add_message(conversation_id, "assistant", response_data["response"])
+        conversation_manager.add_message(
+            conversation_id,
+            "assistant",
+            response_data["response"],
+            faqs=tuple(faq['question'] for faq in response_data["relevant_faqs"])
+        )
         
         return jsonify({
             "reply": response_data["response_with_links"],  # Send processed response with links
             "raw_reply": response_data["response"],  # Also include raw response
             "relevant_faqs": response_data["relevant_faqs"],
             "context_used": response_data["context_used"],
+            "route": response_data["route"],
             "user_name": user_name,
             "conversation_id": conversation_id
         })
     
+    except LLMBusyError as e:
+        print(f"🚦 LLM busy for {conversation_id}: {e}")
+        # The question was never answered; the client will resend it after Retry-After
+        conversation_manager.remove_message(conversation_id, "user", user_input)
+        return rate_limited_response(e.retry_after)
     except Exception as e:
         print(f"❌ Error in chat endpoint: {e}")
         return jsonify({"error": "Internal server error"}), 500
@@ -763,6 +1380,10 @@ def search_faqs():
     if not query:
         return jsonify({"error": "No query provided"}), 400
     
+    limited = enforce_rate_limits("search")
+    if limited:
+        return limited
+    
     try:
         relevant_faqs = rag_system.retrieve_relevant_faqs(query, n_results=5)
         return jsonify({"faqs": relevant_faqs})
@@ -777,7 +1398,7 @@ def health_check():
     return jsonify({
         "status": "healthy",
         "rag_system": "operational",
-        "model": "claude-sonnet-4-5",
+        "model": {"fast": LLM_FAST_MODEL, "strong": LLM_STRONG_MODEL},
         "total_faqs": len(wacs_faqs),
         "hyperlink_processing": "enabled",
         "session_support": "enabled",
@@ -785,6 +1406,204 @@ def health_check():
         "conversation_persistence": "enabled"
     })
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Runtime metrics for rate limiting and LLM scheduling"""
+    return jsonify({
+        "rate_limiter": rate_limiter.get_stats(),
+        "llm_scheduler": llm_scheduler.get_stats(),
+        "model_routes": model_router.get_stats(),
+        "retrieval_cache": rag_system.get_cache_stats(),
+        "embeddings": embedding_model.get_stats()
+    })
+
+@app.route("/admin/profiles", methods=["GET"])
+def list_request_profiles():
+    """List captured per-request profiles"""
+    if not is_admin_request():
+        return admin_forbidden()
+    return jsonify({"enabled": PROFILING_ENABLED, "profiles": request_profiles.list()})
+
+@app.route("/admin/profiles/<profile_id>", methods=["GET"])
+def download_request_profile(profile_id):
+    """Download a per-request profile as a pstats file, or ?format=text for a summary"""
+    if not is_admin_request():
+        return admin_forbidden()
+    capture = request_profiles.get(profile_id)
+    if not capture:
+        return jsonify({"error": "Profile not found"}), 404
+    
+    if request.args.get("format") == "text":
+        sort_key = request.args.get("sort", "cumulative")
+        try:
+            limit = int(request.args.get("limit", 40))
+        except ValueError:
+            return jsonify({"error": "Invalid limit"}), 400
+        if sort_key not in pstats.Stats.sort_arg_dict_default or limit < 1:
+            return jsonify({"error": "Invalid sort or limit"}), 400
+        
+        # pstats.Stats needs a source object exposing create_stats()/stats
+        holder = cProfile.Profile()
+        holder.stats = capture['stats']
+        holder.create_stats = lambda: None
+        out = io.StringIO()
+        stats = pstats.Stats(holder, stream=out)
+        stats.sort_stats(sort_key).print_stats(limit)
+        return Response(out.getvalue(), mimetype="text/plain")
+    
+    return send_file(
+        io.BytesIO(marshal.dumps(capture['stats'])),
+        mimetype="application/octet-stream",
+        as_attachment=True,
+        download_name=f"wacs-{profile_id}.pstats"
+    )
+
+@app.route("/admin/profile/start", methods=["POST"])
+def start_sampling_profile():
+    """Start a time-boxed sampling profile of the whole process"""
+    if not is_admin_request():
+        return admin_forbidden()
+    data = request.get_json(silent=True) or {}
+    try:
+        duration = float(data.get("duration", 30))
+        interval = max(0.001, float(data.get("interval", 0.01)))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid duration or interval"}), 400
+    if not (math.isfinite(duration) and math.isfinite(interval)) or duration <= 0:
+        return jsonify({"error": "Invalid duration or interval"}), 400
+    if not sampling_profiler.start(duration, interval):
+        return jsonify({"error": "Sampling profile already running"}), 409
+    return jsonify({"started": True, "duration": min(duration, PROFILE_MAX_SECONDS), "interval": interval})
+
+@app.route("/admin/profile/stop", methods=["POST"])
+def stop_sampling_profile():
+    """Stop the sampling profile early"""
+    if not is_admin_request():
+        return admin_forbidden()
+    sampling_profiler.stop()
+    return jsonify(sampling_profiler.status())
+
+@app.route("/admin/profile", methods=["GET"])
+def download_sampling_profile():
+    """Sampling profile status, or ?format=collapsed to download the stacks"""
+    if not is_admin_request():
+        return admin_forbidden()
+    if request.args.get("format") == "collapsed":
+        return Response(
+            sampling_profiler.collapsed(),
+            mimetype="text/plain",
+            headers={"Content-Disposition": "attachment; filename=wacs-profile.collapsed"}
+        )
+    return jsonify(sampling_profiler.status())
+
+@app.route("/admin/memory/start", methods=["POST"])
+def start_memory_tracing():
+    """Start tracemalloc so snapshots can attribute allocations"""
+    if not is_admin_request():
+        return admin_forbidden()
+    data = request.get_json(silent=True) or {}
+    try:
+        frames = int(data.get("frames", 1))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid frames"}), 400
+    if frames < 1:
+        return jsonify({"error": "Invalid frames"}), 400
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    return jsonify({"tracing": True})
+
+@app.route("/admin/memory/stop", methods=["POST"])
+def stop_memory_tracing():
+    """Stop tracemalloc and drop its bookkeeping"""
+    if not is_admin_request():
+        return admin_forbidden()
+    tracemalloc.stop()
+    memory_snapshots.clear()
+    return jsonify({"tracing": False})
+
+# Previous snapshot, kept so each call can report growth since the last one
+memory_snapshots = {}
+
+@app.route("/admin/memory/snapshot", methods=["GET"])
+def memory_snapshot():
+    """Top allocators by line, plus growth since the previous snapshot"""
+    if not is_admin_request():
+        return admin_forbidden()
+    if not tracemalloc.is_tracing():
+        return jsonify({"error": "Memory tracing is not running"}), 409
+    
+    try:
+        limit = int(request.args.get("limit", 20))
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    if limit < 1:
+        return jsonify({"error": "Invalid limit"}), 400
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ])
+    
+    def describe(stat):
+        frame = stat.traceback[0]
+        return {
+            "location": f"{frame.filename}:{frame.lineno}",
+            "size_kb": round(stat.size / 1024, 1),
+            "count": stat.count,
+            "size_diff_kb": round(getattr(stat, "size_diff", 0) / 1024, 1)
+        }
+    
+    previous = memory_snapshots.get("previous")
+    memory_snapshots["previous"] = snapshot
+    current, peak = tracemalloc.get_traced_memory()
+    return jsonify({
+        "traced_kb": round(current / 1024, 1),
+        "peak_kb": round(peak / 1024, 1),
+        "top_allocators": [describe(s) for s in snapshot.statistics("lineno")[:limit]],
+        "growth_since_previous": [describe(s) for s in snapshot.compare_to(previous, "lineno")[:limit]] if previous else [],
+        "conversation_manager": conversation_manager.get_stats()
+    })
+
+@app.route("/admin/export", methods=["GET"])
+def export_conversations():
+    """Stream conversations as NDJSON for analytics.
+    
+    Query params: cursor (resume after this value), since (epoch seconds on last_activity),
+    limit, batch_size and include_faqs=1. Each conversation line carries its cursor and the
+    final line reports next_cursor, so an interrupted export can be resumed.
+    """
+    if not is_admin_request():
+        return admin_forbidden()
+    try:
+        cursor = int(request.args.get("cursor", 0))
+        since = float(request.args["since"]) if request.args.get("since") else None
+        limit = int(request.args.get("limit", 0))
+        batch_size = max(1, min(int(request.args.get("batch_size", 200)), 1000))
+    except ValueError:
+        return jsonify({"error": "Invalid cursor, since, limit or batch_size"}), 400
+    if cursor < 0 or limit < 0 or (since is not None and not math.isfinite(since)):
+        return jsonify({"error": "Invalid cursor, since, limit or batch_size"}), 400
+    include_faqs = request.args.get("include_faqs") in ("1", "true")
+    
+    def generate():
+        next_cursor, exported, done = cursor, 0, False
+        while not done:
+            # Each batch holds the store lock only long enough to copy references
+            records, batch_cursor, done = conversation_manager.export_batch(
+                next_cursor, since, batch_size, include_faqs
+            )
+            for record in records:
+                yield json.dumps({"type": "conversation", **record}) + "\n"
+                exported += 1
+                if limit and exported >= limit:
+                    next_cursor, done = record["cursor"], True
+                    break
+            else:
+                next_cursor = batch_cursor
+            time.sleep(0)  # Let request threads have the GIL between batches
+        yield json.dumps({"type": "end", "exported": exported, "next_cursor": next_cursor}) + "\n"
+    
+    return Response(generate(), mimetype="application/x-ndjson")
+
 @app.route("/process-text", methods=["POST"])
 def process_text():
     """Endpoint to process any text and add hyperlinks"""
@@ -792,6 +1611,10 @@ def process_text():
     if not text:
         return jsonify({"error": "No text provided"}), 400
     
+    limited = enforce_rate_limits("process_text")
+    if limited:
+        return limited
+    
     try:
         processed_text = rag_system.hyperlink_processor.convert_to_hyperlinks(text)
         return jsonify({
@@ -827,7 +1650,7 @@ def serve_static(filename):
 
 if __name__ == "__main__":
     port = int(os.environ.get('PORT', 8081))
-    print(f"🚀 Starting WACS Chatbot with Claude Sonnet 4.5 on port {port}")
+    print(f"🚀 Starting WACS Chatbot with {LLM_FAST_MODEL} / {LLM_STRONG_MODEL} on port {port}")
     print(f"📁 Working directory: {os.getcwd()}")
     print(f"📄 Frontend exists: {os.path.exists('frontend/index2.html')}")
     